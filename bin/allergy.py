@@ -1,17 +1,26 @@
 from testdata import ALLERGIES_FILE
+import rowindex
 import argparse
 import csv
 
 
-class Allergy: 
+class Allergy(object): 
     """Create instances of Allergy; 
 also maintains complete allergy lists by patient id"""
 
+    __slots__ = ('pid','statement','type','allergen','system','code','start','end',
+                 'reaction','snomed','severity','severity_code')
+
     allergies = {} # Dictionary of allergy lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Allergy observations"""
+    def load(cls,pid=None,rows=None):
+      """Loads patient Allergy observations (just those for patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(ALLERGIES_FILE,'PID',pid)
+        for allergy in rows: cls(allergy)
+        return
       
       # Loop through allergies and build patient allergy lists:
       probs = csv.reader(file(ALLERGIES_FILE,'U'),dialect='excel-tab')
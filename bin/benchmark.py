@@ -0,0 +1,187 @@
+"""Benchmarks the generator pipeline on the data files scaled up to several
+times as many patients, timing each stage (loading, building the patient
+graphs section by section, serializing, writing files and the Indivo
+profiles) and reporting the results as JSON"""
+from testdata import DATA_PATH, NOTES_PATH, PID_FIELDS, PID_STEP
+import argparse
+import csv
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+def scaleData(src,dst,factor):
+    """Writes a copy of the data files in src to dst, with every patient
+repeated factor times (under new ids); returns the row counts by file"""
+    rows = {}
+    for name in sorted(os.listdir(src)):
+      path = os.path.join(src,name)
+      if not name.endswith('.txt') or not os.path.isfile(path): continue
+      reader = csv.reader(file(path,'U'),dialect='excel-tab')
+      header = reader.next()
+      data = list(reader)
+      out = open(os.path.join(dst,name),'w')
+      writer = csv.writer(out,dialect='excel-tab',lineterminator='\n')
+      writer.writerow(header)
+      column = [i for i, f in enumerate(header) if f in PID_FIELDS]
+      if not column: # Not patient data: just copy it
+        writer.writerows(data)
+        rows[name] = len(data)
+      else:
+        c = column[0]
+        for k in range(factor):
+          for row in data:
+            if k: row = row[:c] + [str(int(row[c])+k*PID_STEP)] + row[c+1:]
+            writer.writerow(row)
+        rows[name] = len(data)*factor
+      out.close()
+
+    # Every copy of a patient gets the same notes:
+    notes = os.path.join(src,'notes')
+    if os.path.isdir(notes):
+      for pid in os.listdir(notes):
+        for k in range(factor):
+          shutil.copytree(os.path.join(notes,pid),
+                          os.path.join(dst,'notes',str(int(pid)+k*PID_STEP)))
+    return rows
+
+class Timer:
+    """Accumulates the time taken by named steps"""
+    def __init__(self):
+        self.seconds = {}
+    def run(self,name,f,*args):
+        start = time.time()
+        result = f(*args)
+        self.seconds[name] = self.seconds.get(name,0.0) + time.time() - start
+        return result
+
+def rate(n,seconds):
+    return round(n/seconds,2) if seconds else None
+
+def run(limit,format,out):
+    """Runs the pipeline on the data in DATA_PATH (writing into out);
+returns the results as a dictionary"""
+    import generate
+    from patient import Patient
+
+    loading = Timer()
+    for cls in generate.SOURCES:
+      loading.run(cls.__name__,cls.load)
+    pids = sorted(Patient.mpi)[:limit]
+
+    build, stages = Timer(), Timer()
+    triples = size = 0
+    for pid in pids:
+      g = generate.PatientGraph(Patient.mpi[pid])
+      for section in generate.SECTIONS:
+        build.run(section,getattr(g,section))
+      triples += len(g.g)
+      rdf = stages.run('serialize',g.toRDF,format)
+      size += len(rdf)
+      f = open(os.path.join(out,generate.FILE_NAME_TEMPLATE%pid),'w')
+      stages.run('write',f.write,rdf)
+      f.close()
+    stages.seconds['build'] = sum(build.seconds.values())
+
+    indivo = {}
+    try:
+      from indivo import IndivoSamplePatient
+      os.mkdir(os.path.join(out,'indivo'))
+      devnull = open(os.devnull,'w')
+      stdout, sys.stdout = sys.stdout, devnull # Quiet its progress messages
+      try:
+        for pid in pids:
+          stages.run('indivo',IndivoSamplePatient(pid,os.path.join(out,'indivo')).writePatientData)
+      finally: sys.stdout = stdout
+    except Exception, e: # Don't lose the other results
+      indivo['error'] = "%s: %s"%(e.__class__.__name__,e)
+
+    rdf_seconds = stages.seconds['build']+stages.seconds['serialize']+stages.seconds['write']
+    load_seconds = sum(loading.seconds.values())
+    results = {
+      'patients': len(Patient.mpi),
+      'patients_written': len(pids),
+      'triples': triples,
+      'rdf_bytes': size,
+      'stages': {
+        'load': {'seconds': load_seconds, 'sources': loading.seconds},
+        'build': {'seconds': stages.seconds['build'], 'sections': build.seconds,
+                  'triples_per_s': rate(triples,stages.seconds['build'])},
+        'serialize': {'seconds': stages.seconds['serialize'],
+                      'triples_per_s': rate(triples,stages.seconds['serialize'])},
+        'write': {'seconds': stages.seconds['write']},
+      },
+      'throughput': {
+        'load_patients_per_s': rate(len(Patient.mpi),load_seconds),
+        'rdf_patients_per_s': rate(len(pids),rdf_seconds),
+        'rdf_triples_per_s': rate(triples,rdf_seconds),
+      },
+      # ru_maxrss is in kilobytes on Linux (but bytes on OS X)
+      'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if 'indivo' in stages.seconds:
+      indivo['seconds'] = stages.seconds['indivo']
+      indivo['patients_per_s'] = rate(len(pids),stages.seconds['indivo'])
+    results['stages']['indivo'] = indivo
+    return results
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Generator pipeline benchmark')
+  parser.add_argument('--scale', type=int, nargs='+', default=[1,10,100], metavar='N',
+                      help='Multiples of the patients in the data files to run with (default = 1 10 100)')
+  parser.add_argument('--limit', type=int, metavar='N',
+                      help='Only write the first N patients of each run (everything is still loaded)')
+  parser.add_argument('--rdf-format', default='xml', dest='format',
+                      choices=['xml','turtle','nt','pretty-xml','trix','n3'],
+                      help='RDF serialization format (default = xml)')
+  parser.add_argument('--output', metavar='FILE', help='Write the JSON results to FILE (default: stdout)')
+  parser.add_argument('--keep', metavar='DIR',
+                      help='Keep the scaled data and output under DIR (default: a temporary directory)')
+  parser.add_argument('--run', metavar='DIR', help=argparse.SUPPRESS) # One run, in a child process
+  args = parser.parse_args()
+  if min(args.scale) < 1: parser.error("--scale factors must be at least 1")
+
+  if args.run:
+    json.dump(run(args.limit,args.format,args.run),sys.stdout)
+    parser.exit()
+
+  work = args.keep or tempfile.mkdtemp(prefix='smart-benchmark-')
+  report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+            'format': args.format, 'limit': args.limit, 'runs': []}
+  try:
+    for factor in args.scale:
+      base = os.path.join(work,'x%d'%factor)
+      data, out = os.path.join(base,'data'), os.path.join(base,'out')
+      os.makedirs(data)
+      os.makedirs(out)
+      start = time.time()
+      rows = scaleData(DATA_PATH,data,factor)
+      scaling = time.time()-start
+
+      # Each run gets a fresh process, so its loaded state and peak RSS are its own
+      env = dict(os.environ, SMART_DATA_PATH=data)
+      command = [sys.executable, sys.argv[0], '--run', out, '--rdf-format', args.format]
+      if args.limit: command += ['--limit', str(args.limit)]
+      child = subprocess.Popen(command, env=env, stdout=subprocess.PIPE)
+      output = child.communicate()[0]
+      if child.returncode:
+        parser.error("Benchmark run at scale %d failed"%factor)
+      results = json.loads(output)
+      results.update({'scale': factor, 'rows': rows, 'scaling_seconds': scaling})
+      report['runs'].append(results)
+      print >>sys.stderr, "x%d: %d patients loaded in %.1fs, %s patients/s written"%(
+        factor, results['patients'], results['stages']['load']['seconds'],
+        results['throughput']['rdf_patients_per_s'])
+  finally:
+    if not args.keep: shutil.rmtree(work)
+
+  if args.output:
+    f = open(args.output,'w')
+    json.dump(report,f,indent=2,sort_keys=True)
+    f.close()
+  else: print json.dumps(report,indent=2,sort_keys=True)
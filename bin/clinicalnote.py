@@ -1,26 +1,156 @@
-from testdata import NOTES_PATH
+from testdata import NOTES_PATH, NOTES_CACHE_PATH
+from rdflib import ConjunctiveGraph, RDF, URIRef
+from rdfstream import Fragment
 import argparse
+import cPickle
 import csv
+import hashlib
+import multiprocessing
 import os
+import sys
+import time
 from common.rdf_tools.util import *
 
-class ClinicalNote: 
+def noteFiles(pid=None):
+    """Returns the paths of the note files of each patient (or just of
+patient pid), by patient id"""
+    if not os.path.isdir(NOTES_PATH): return {}
+    files = {}
+    for pid in (os.listdir(NOTES_PATH) if pid is None else [pid]):
+      patientpath = os.path.join(NOTES_PATH, pid)
+      if not os.path.isdir(patientpath): continue
+      files[pid] = [os.path.join(patientpath, notefile) for notefile in os.listdir(patientpath)]
+    return files
+
+CLINICAL_NOTE = URIRef("http://smartplatforms.org/terms#ClinicalNote")
+
+def toGraph(triples):
+    """Returns an rdflib graph of triples"""
+    g = ConjunctiveGraph()
+    for t in triples: g.add(t)
+    return g
+
+def _cached(cache):
+    """Returns the object pickled in file cache, or None"""
+    try:
+      f = open(cache,'rb')
+      try: return cPickle.load(f)
+      finally: f.close()
+    except Exception: return None # Not cached (or unreadable)
+
+def _cache(cache,value):
+    """Pickles value to file cache, if it can"""
+    try:
+      if not os.path.isdir(NOTES_CACHE_PATH): os.makedirs(NOTES_CACHE_PATH)
+      f = open(cache+'.%d.tmp'%os.getpid(),'wb') # (Workers may race to cache a note)
+      cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+      f.close()
+      os.rename(f.name, cache)
+    except (IOError, OSError): pass # Just make it again next time
+
+def parseNote(path):
+    """Parses a note file, or loads it from the cache of parsed notes (by the
+hash of its contents) if it has been parsed before.  Returns (path, triples,
+seconds, cached, error); triples is None if there was an error."""
+    start = time.time()
+    try:
+      data = open(path,'rb').read()
+      cache = os.path.join(NOTES_CACHE_PATH, hashlib.sha1(data).hexdigest()+'.pickle')
+      triples = _cached(cache)
+      if triples is not None: return path, triples, time.time()-start, True, None
+      triples = list(parse_rdf(data))
+      _cache(cache, triples)
+      return path, triples, time.time()-start, False, None
+    except Exception, e:
+      return path, None, time.time()-start, False, "%s: %s"%(e.__class__.__name__, e)
+
+def noteFragment(path, format, namespaces):
+    """Returns (fragment, note) for a note file: its triples pre-serialized
+as an rdfstream.Fragment in format with namespaces, and its ClinicalNote
+node.  Fragments are cached along with the parsed notes.  Returns None if
+the note can't be read or parsed (which load reports), or has no
+ClinicalNote node (reported here)."""
+    try: data = open(path,'rb').read()
+    except IOError: return None
+    cache = os.path.join(NOTES_CACHE_PATH, '%s.%s.fragment'%(hashlib.sha1(data).hexdigest(),
+                         hashlib.sha1(repr((format, namespaces))).hexdigest()[:12]))
+    fragment = _cached(cache)
+    if fragment is not None: return fragment
+    path, triples, seconds, cached, error = parseNote(path)
+    if error: return None
+    notes = [s for s, p, o in triples if p == RDF.type and o == CLINICAL_NOTE]
+    if not notes:
+      print >>sys.stderr, "Skipping clinical note %s (no ClinicalNote in it)"%path
+      return None
+    fragment = (Fragment(triples, format, namespaces), notes[0])
+    _cache(cache, fragment)
+    return fragment
+
+def parseNotes(paths, jobs=1):
+    """Parses the note files in paths with parseNote, in jobs worker processes;
+yields the results in order"""
+    if jobs == 1 or len(paths) < 2:
+      for path in paths: yield parseNote(path)
+      return
+    pool = multiprocessing.Pool(jobs)
+    try:
+      for result in pool.imap(parseNote, paths, max(1, len(paths)/(jobs*8))): yield result
+    finally:
+      pool.close()
+      pool.join()
+
+class ClinicalNote:
     """Create instances of ClinicalNote; also maintains notes by patient id"""
 
     clinicalNotes = {} # Dictionary of clinicalNote by patient ID
 
     @classmethod
-    def load(cls):
-        """Loads patient ClinicalNote"""
-      
-        try:
-          # Loop through clinicalNotes and build patient clinicalNote lists:
-          for pid in os.listdir(NOTES_PATH):
-              cls.clinicalNotes[pid] = []
-              patientpath = os.path.join(NOTES_PATH, pid)
-              for notefile in os.listdir(patientpath):
-                  noteval = open(os.path.join(patientpath, notefile)).read()
-                  notegraph = parse_rdf(noteval)
-                  cls.clinicalNotes[pid].append(notegraph)
-        except:
-            pass
\ No newline at end of file
+    def load(cls,pid=None,jobs=1):
+        """Loads patient ClinicalNote (just the notes of patient pid, if given),
+parsing the notes that aren't cached yet in jobs processes.  Notes that
+can't be parsed are reported and skipped."""
+        files = noteFiles(pid)
+        paths = []
+        for pid in files:
+          cls.clinicalNotes[pid] = []
+          paths += [(pid, path) for path in files[pid]]
+        results = parseNotes([path for pid, path in paths], jobs)
+        for (pid, path), (path, triples, seconds, cached, error) in zip(paths, results):
+          if error: print >>sys.stderr, "Skipping clinical note %s (%s)"%(path, error)
+          else: cls.clinicalNotes[pid].append(toGraph(triples))
+
+    @classmethod
+    def fragments(cls,pid,format,namespaces):
+        """Returns (fragment, note) for each of patient pid's notes, as
+noteFragment does, for splicing straight into a StreamingGraph instead of
+merging the note graphs.  (Notes that can't be read or parsed are left
+out; load reports them.)"""
+        fragments = [noteFragment(path, format, namespaces) for path in noteFiles(pid).get(pid, [])]
+        return [f for f in fragments if f]
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Clinical Note Ingestion')
+  parser.add_argument('--jobs', metavar='N', type=int, default=multiprocessing.cpu_count(),
+                      help='number of worker processes to parse notes in (default = the number of CPUs)')
+  parser.add_argument('pids', metavar='pid', nargs='*',
+                      help='patients whose notes to parse (default = all)')
+  args = parser.parse_args()
+  if args.jobs < 1: parser.error("--jobs must be at least 1")
+
+  # Parse the notes into the cache, reporting each one:
+  files = noteFiles() if not args.pids else {}
+  for pid in args.pids: files.update(noteFiles(pid))
+  paths = sorted(path for pid in files for path in files[pid])
+  parsed = cached = failed = 0
+  start = time.time()
+  for path, triples, seconds, hit, error in parseNotes(paths, args.jobs):
+    if error:
+      failed += 1
+      print "%s: FAILED after %.3fs: %s"%(path, seconds, error)
+    else:
+      if hit: cached += 1
+      else: parsed += 1
+      print "%s: %d triples, %.3fs%s"%(path, len(triples), seconds, " (cached)" if hit else "")
+  print "%d notes parsed, %d already cached, %d failed in %.1fs"%(parsed, cached, failed, time.time()-start)
+  if failed: sys.exit(1)
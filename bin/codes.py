@@ -1,24 +1,26 @@
-"""Module for importing code mapping files: only LOINC required for now"""
+"""Module for importing code mapping files: LOINC, and the tables mapping the
+codes of the raw extracts to standard codes"""
 from testdata import LOINC_FILE
+from rowindex import RowIndex
 import argparse
-import csv
 
 class Loinc:
     """Creates loinc code instances and holds global loinc dictionary"""
     info = {} # Dictionary of loinc code information
 
+    @classmethod
+    def lookup(cls,code):
+      """Returns the Loinc instance for code, reading it from the map on
+demand (None if the code isn't in the map)"""
+      if code in cls.info: return cls.info[code]
+      rows = list(RowIndex.open(LOINC_FILE,'LOINC_NUM').rows(code))
+      if not rows: return None
+      return cls(rows[-1]) # Creates a loinc instance and stores it in Loinc.info
+
     @classmethod
     def load(cls,loinc_list):
       """Loads code_info dictionary for LOINC codes in loinc_list"""
-      
-      # Open data file and read in the first (header) record
-      loincs = csv.reader(file(LOINC_FILE,'U'),dialect='excel-tab')
-      header = loincs.next() 
-      # Now, read in loinc codes:
-      for loinc in loincs: 
-        l = dict(zip(header,loinc)) # build row dictionary of values
-        if l['LOINC_NUM'] in loinc_list: # See if we're interested in this code  
-          cls(l) # If so, creat a loinc instance and store it in Loinc.info
+      for code in loinc_list: cls.lookup(code)
 
     def __init__(self,l):
         """Creates a loinc instance and save it in Loinc.info"""
@@ -31,6 +33,33 @@ class Loinc:
         self.units_required = l['UNITSREQUIRED']
         self.__class__.info[self.code]=self
 
+class CodeMap:
+    """Table mapping source codes (e.g. the ICD-9 and NDC codes of the raw
+extracts) to standard codes, read from its mapping file on demand through
+the file's index by SOURCE_CODE"""
+
+    def __init__(self,filename,column):
+        self.filename = filename
+        self.column = column # Column of the standard code
+        self.rows = {} # (source code, name) -> row of the map, or None
+
+    def row(self,code,name=None):
+        """Returns the row of the map (as a dictionary) for source code (its
+row for name, if the map has rows for several names), or None if it isn't
+in the map"""
+        key = (code,name)
+        if not key in self.rows:
+          rows = list(RowIndex.open(self.filename,'SOURCE_CODE').rows(code))
+          rows = [r for r in rows if r.get('NAME') == name] or rows
+          self.rows[key] = rows[0] if rows else None
+        return self.rows[key]
+
+    def lookup(self,code,name=None):
+        """Returns the standard code for source code (as row does), or None
+if it isn't in the map"""
+        row = self.row(code,name)
+        return row[self.column] if row else None
+
 if __name__== '__main__':
 
   parser = argparse.ArgumentParser(description='Test Data Codes Module')
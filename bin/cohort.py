@@ -0,0 +1,164 @@
+"""Amplifies the patient data files into a larger synthetic cohort, for load
+testing: every patient is copied (along with their labs, meds, refills,
+problems, vitals, immunizations, etc.) under new ids, each copy with new
+demographics, its dates shifted and its lab results and vital signs
+jittered.  Only the original rows are held in memory; the copies are
+written out a row at a time.  (Clinical notes aren't copied.)"""
+from testdata import DATA_PATH, PATIENTS_FILE, PID_FIELDS, PID_STEP
+from testdata import patientRandom, setSeed
+from patient import Patient
+import argparse
+import csv
+import datetime
+import os
+import random
+import re
+import testdata
+
+MAX_SHIFT = 3*365 # Each copy's dates move by up to this many days, either way
+
+# Standard deviation (relative to the value) of the noise added to each
+# row's numeric values, by file and column:
+JITTER = {'labs.txt': {'VALUE': 0.05},
+          'vitals.txt': {'HEART_RATE': 0.05, 'RESPIRATORY_RATE': 0.05, 'TEMPERATURE': 0.005,
+                         'SYSTOLIC': 0.05, 'DIASTOLIC': 0.05}}
+
+DATE = re.compile(r'(\d{4})(?:-(\d\d)-(\d\d))?(.*)$') # 2008-01-24, 2000, 1997-09-25T10:00:00Z
+
+def isDate(field):
+    return 'DATE' in field.upper() or field.upper() in ('TIMESTAMP','DOB')
+
+def shiftDate(value,days):
+    """Returns date (or year) value moved by days"""
+    m = DATE.match(value)
+    if not m: return value
+    year, month, day, rest = m.groups()
+    if not month: return "%d%s"%(int(year)+int(round(days/365.25)),rest)
+    d = datetime.date(int(year),int(month),int(day)) + datetime.timedelta(days)
+    return d.isoformat()+rest
+
+def rescale(value,factor):
+    """Returns numeric value times factor, to the same number of decimal
+places (other values are returned as they are)"""
+    try: x = float(value)
+    except ValueError: return value
+    places = len(value.split('.')[1]) if '.' in value else 0
+    return "%.*f"%(places,max(0.0,x*factor))
+
+def pidStep(src):
+    """Returns the step between the ids of the copies of a patient for the
+data files in src: PID_STEP, or the next power of ten above the largest id
+in them if that is larger (e.g. when src has been amplified already), so no
+copy gets the id of a patient already there"""
+    largest = 0
+    for name in os.listdir(src):
+      path = os.path.join(src,name)
+      if not name.endswith('.txt') or not os.path.isfile(path): continue
+      reader = csv.reader(file(path,'U'),dialect='excel-tab')
+      columns = [i for i, f in enumerate(reader.next()) if f in PID_FIELDS]
+      if not columns: continue
+      c = columns[0]
+      for row in reader:
+        if len(row) > c and row[c].isdigit(): largest = max(largest,int(row[c]))
+    return max(PID_STEP,10**len(str(largest)))
+
+class Clone(object):
+    """The k-th copy of patient pid (with ids step apart): its id, date shift
+and body size (from seed, which makes them the same in every data file), and
+the random generator for its rows of one data file"""
+    __slots__ = ('pid','days','height','weight','rng')
+
+    def __init__(self,pid,k,step,name,seed):
+        self.pid = str(int(pid)+k*step)
+        rng = patientRandom(self.pid,'cohort',seed)
+        self.days = rng.randint(-MAX_SHIFT,MAX_SHIFT)
+        self.height = rng.gauss(1,0.03)
+        self.weight = rng.gauss(1,0.08)
+        self.rng = patientRandom(self.pid,'cohort/'+name)
+
+    def row(self,name,header,row):
+        """Returns the copy of row, from data file name with header"""
+        jitter = JITTER.get(name,{})
+        if dict(zip(header,row)).get('SCALE','Qn') != 'Qn': jitter = {} # Not a number
+        copy = []
+        for f, v in zip(header,row):
+          if f in PID_FIELDS: v = self.pid
+          elif not v: pass
+          elif isDate(f): v = shiftDate(v,self.days)
+          elif f in jitter: v = rescale(v,self.rng.gauss(1,jitter[f]))
+          elif name == 'vitals.txt':
+            if f == 'HEIGHT': v = rescale(v,self.height)
+            elif f == 'WEIGHT': v = rescale(v,self.weight)
+            elif f == 'BMI': v = rescale(v,self.weight/self.height**2)
+          copy.append(v)
+        return copy + row[len(copy):]
+
+    def patient(self,header,row):
+        """Returns the copy of a row of the patients file: a new synthetic
+patient, born on the original's (shifted) birthday"""
+        original = dict(zip(header,row))
+        dob = shiftDate(original['dob'],self.days)
+        # (Some patients have no raw GENDER or YOB, so go by gender and dob)
+        raw = dict(original, GENDER='M' if original['gender']=='male' else 'F', YOB=dob[:4])
+        p = Patient.synthesize(raw,self.rng)
+        p.update(PID=self.pid, dob=dob, GENDER=original['GENDER'])
+        if original['YOB']:
+          p['YOB'] = str(int(original['YOB'])+int(dob[:4])-int(original['dob'][:4]))
+        return [p[f] for f in header]
+
+def amplify(src,dst,factor):
+    """Writes the data files in src to dst with each patient copied factor-1
+times (src may be dst); yields (file name, rows written) as each is done"""
+    # Each copy must be shifted and sized the same in every file, so without
+    # a seed the run gets one of its own for that
+    seed = testdata.SEED if testdata.SEED is not None else random.getrandbits(64)
+    step = pidStep(src)
+    for name in sorted(os.listdir(src)):
+      path = os.path.join(src,name)
+      if not name.endswith('.txt') or not os.path.isfile(path): continue
+      reader = csv.reader(file(path,'U'),dialect='excel-tab')
+      header = reader.next()
+      rows = list(reader)
+      columns = [i for i, f in enumerate(header) if f in PID_FIELDS]
+      patients = name == os.path.basename(PATIENTS_FILE)
+
+      target = os.path.join(dst,name)
+      out = open(target+'.tmp','w')
+      writer = csv.writer(out,dialect='excel-tab',lineterminator='\n')
+      writer.writerow(header)
+      writer.writerows(rows)
+      count = len(rows)
+      if columns:
+        c = columns[0]
+        for k in range(1,factor):
+          clones = {} # pid -> Clone, for copy k
+          for row in rows:
+            if len(row) <= c: continue
+            pid = row[c]
+            if not pid in clones: clones[pid] = Clone(pid,k,step,name,seed)
+            if patients: writer.writerow(clones[pid].patient(header,row))
+            else: writer.writerow(clones[pid].row(name,header,row))
+            count += 1
+      out.close()
+      os.rename(target+'.tmp',target)
+      yield name, count
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Synthetic Cohort Amplifier')
+  parser.add_argument('factor', type=int,
+                      help='Number of copies of each patient to write (including the original)')
+  parser.add_argument('--seed', metavar='S',
+                      help='seed the copies, so every run with the same seed writes the same data')
+  parser.add_argument('--data', metavar='dir', default=DATA_PATH,
+                      help='Directory of the data files to copy (default = the data directory)')
+  parser.add_argument('--output', metavar='dir',
+                      help='Directory to write the data files into (default = the --data directory, replacing its files)')
+  args = parser.parse_args()
+  if args.factor < 1: parser.error("The factor must be at least 1")
+  setSeed(args.seed)
+
+  output = args.output or args.data
+  if not os.path.isdir(output): os.makedirs(output)
+  for name, count in amplify(args.data,output,args.factor):
+    print "%s: %d rows"%(name,count)
@@ -0,0 +1,328 @@
+"""Transforms the raw extracts in ri-data into the data files: the conditions
+(ri-conds) into problems.txt, the prescriptions (ri-sigs) into meds.txt, the
+dispensings (ri-meds, joined to their prescriptions) into refills.txt and
+the observations (ri-obs) into labs.txt.  Each extract is streamed through in one pass, a patient at a
+time, with the stages run in parallel.  Source codes are mapped to SNOMED,
+RxNorm and LOINC through the indexed tables in the maps directory (which
+--learn-maps derives from the current data files), and the lab results are
+joined to the LOINC map for their scales (and named, and given their Ord
+choices, as in the observation map)."""
+from testdata import DATA_PATH, RI_PATH, GENERATED_PATH, PROBLEMS_FILE, MEDS_FILE
+from testdata import REFILLS_FILE, LABS_FILE, ICD9_SNOMED_FILE, NDC_RXNORM_FILE, OBS_LOINC_FILE
+from codes import CodeMap, Loinc
+from normalize import sortFile
+from patientstream import groups, sortedFile
+import argparse
+import collections
+import csv
+import multiprocessing
+import os
+import re
+import sys
+
+ICD9_SNOMED = CodeMap(ICD9_SNOMED_FILE,'SNOMED')
+NDC_RXNORM = CodeMap(NDC_RXNORM_FILE,'RXNORM')
+OBS_LOINC = CodeMap(OBS_LOINC_FILE,'LOINC')
+
+# The doses and frequencies of the sigs: (pattern, replacement) for the
+# abbreviations, dose units by the words that give them away, and doses a
+# day by frequency
+SIG_TERMS = ((r'\bQ\s*(\d+)\s*(?:HRS?|H)\b', r'q\1h'), (r'\bQ\s*(\d+)\s*MIN\b', r'q\1min'),
+             (r'\bX\s*(\d+)', r'x\1'), (r'\bQ\s*WK\b', 'weekly'), (r'\bQD\b', 'daily'),
+             (r'\bAS NEEDED\b', 'prn'), (r'\bDROPS?\b', 'gtt'), (r'\bTABS?\b\s*', ''))
+DOSE_UNITS = (('puff','{puff}'), ('gtt','[drp]'), ('ml','mL'), ('inch','[in_us]'), ('neb','{dose}'))
+FREQUENCIES = {'daily': 1, 'qhs': 1, 'qam': 1, 'qpm': 1, 'bid': 2, 'tid': 3, 'qid': 4}
+DOSE = re.compile(r'^(\d+(?:\.\d+)?)(?:/(\d+))?\s')
+EVERY_HOURS = re.compile(r'\bq(\d+)h\b')
+
+def parseSig(sig):
+    """Returns (sig, dose, dose unit, frequency, frequency unit) for a
+prescription's sig, e.g. '1 TAB Q 6 HR PRN PAIN' is ('1 q6h prn pain', '1',
+'{tablet}', '4', '/d'); the values that can't be made out are ''"""
+    sig = " ".join(sig.split())
+    for pattern, replacement in SIG_TERMS: sig = re.sub(pattern,replacement,sig)
+    sig = sig.lower()
+    dose = unit = freq = frequnit = ''
+    m = DOSE.match(sig+' ')
+    if m:
+      dose = m.group(1) if not m.group(2) else str(float(m.group(1))/int(m.group(2)))
+      unit = '{tablet}'
+      for word, u in DOSE_UNITS:
+        if word in sig: unit = u
+    words = sig.split()
+    m = EVERY_HOURS.search(sig)
+    if 'weekly' in words: freq, frequnit = '1', '/wk'
+    elif m and int(m.group(1)): freq, frequnit = '%g'%(24.0/int(m.group(1))), '/d'
+    else:
+      for word in words:
+        if word in FREQUENCIES:
+          freq, frequnit = str(FREQUENCIES[word]), '/d'
+          break
+    return sig, dose, unit, freq, frequnit
+
+def isNumber(value):
+    try: float(value)
+    except ValueError: return False
+    return True
+
+def problemRows(pid,rows,joined,unmapped):
+    """ri-conds -> problems.txt: the first diagnosis of each condition"""
+    seen = set()
+    for r in rows:
+      code = r['SOURCE_CONDITION_CODE']
+      if code in seen: continue
+      snomed = ICD9_SNOMED.lookup(code,r['DIAGNOSIS'])
+      if not snomed:
+        unmapped.add(code)
+        continue
+      seen.add(code)
+      yield [pid, r['DX_DATE'], '', snomed, r['DIAGNOSIS']]
+
+def medRows(pid,rows,joined,unmapped):
+    """ri-sigs -> meds.txt: each drug, as it was first prescribed"""
+    seen = set()
+    for r in rows:
+      rxn = NDC_RXNORM.lookup(r['SOURCE_DRUG_CODE'])
+      if not rxn:
+        unmapped.add(r['SOURCE_DRUG_CODE'])
+        continue
+      if rxn in seen: continue
+      seen.add(rxn)
+      sig, dose, unit, freq, frequnit = parseSig(r['SIG'])
+      yield [pid, r['START_DATE'], '', rxn, r['DRUG'], sig, r['DRUG_QUANTITY'], r['DAYS_SUPPLY'],
+             r['REFILLS'], dose, unit, freq, frequnit]
+
+def supply(r,sig):
+    """Returns the (days supply, quantity) of dispensing r (a row of ri-meds);
+the dispensings often have 0 for them, so those come from its prescription,
+sig (a row of ri-sigs, or None)"""
+    days, q = r['DAYS_SUPPLY'], r['DRUG_QUANTITY']
+    if sig:
+      if days == '0': days = sig['DAYS_SUPPLY']
+      if q == '0': q = sig['DRUG_QUANTITY']
+    return days, q
+
+def refillRows(pid,rows,sigs,unmapped):
+    """ri-meds (joined to ri-sigs) -> refills.txt: every dispensing of a drug"""
+    prescribed = dict(((s['START_DATE'],s['SOURCE_DRUG_CODE']), s) for s in sigs)
+    for r in rows:
+      rxn = NDC_RXNORM.lookup(r['SOURCE_DRUG_CODE'])
+      if not rxn:
+        unmapped.add(r['SOURCE_DRUG_CODE'])
+        continue
+      days, q = supply(r,prescribed.get((r['START_DATE'],r['SOURCE_DRUG_CODE'])))
+      yield [pid, r['START_DATE'], rxn, days, q]
+
+def labRows(pid,rows,joined,unmapped):
+    """ri-obs -> labs.txt: every result of an observation with a LOINC code,
+scaled as in the LOINC map, and named (and, for Ord results, given their
+choices) as in the observation map"""
+    for r in rows:
+      m = OBS_LOINC.row(r['TERM_ID'])
+      if not m:
+        unmapped.add(r['TERM_ID'])
+        continue
+      code = m['LOINC']
+      value, low, high = r['OBS_VALUE_AS_STRING'], r['OBS_RANGE_LOW'], r['OBS_RANGE_HIGH']
+      loinc = Loinc.lookup(code)
+      if loinc: scale, name = loinc.scale, loinc.name
+      else: scale, name = 'Qn' if isNumber(value) else 'Nar', r['UNIVERSALNAME']
+      name = m['LAB_NAME'] or name
+      if scale == 'Ord':
+        # Ord results keep their choices in LOW (if the value is one of them)
+        choices = dict((c.lower(), c) for c in m['CHOICES'].split('; ') if c)
+        if value.lower() in choices: value, low = choices[value.lower()], m['CHOICES']
+        else: low = ''
+      elif scale != 'Qn' and low == '0': low = '' # (Not a range)
+      yield [pid, r['OBS_DATE'], code, scale, name, value, low, high, r['UNITS']]
+
+# The stages: (data file, extract, extract joined to it (or None), header of
+# the data file, transform).  The transforms are given a patient's rows of
+# both extracts.
+STAGES = ((os.path.basename(PROBLEMS_FILE), 'ri-conds.txt', None,
+           ('PID','START_DATE','END_DATE','SNOMED','NAME'), problemRows),
+          (os.path.basename(MEDS_FILE), 'ri-sigs.txt', None,
+           ('PT_ID','START_DATE','END_DATE','RxNorm','Name','SIG','Q','DAYS','REFILLS',
+            'Q_TO_TAKE_VALUE','Q_TO_TAKE_UNIT','FREQUENCY_VALUE','FREQUENCY_UNIT'), medRows),
+          (os.path.basename(REFILLS_FILE), 'ri-meds.txt', 'ri-sigs.txt',
+           ('PID','DATE','RXN','DAYS','Q'), refillRows),
+          (os.path.basename(LABS_FILE), 'ri-obs.txt', None,
+           ('PID','DATE','LOINC','SCALE','NAME','VALUE','LOW','HIGH','UNITS'), labRows))
+
+def patients(src,join=None):
+    """Yields (patient id, rows, rows in extract join) for each patient in
+extract src, in patient id order (join's rows are [] if there's no join)"""
+    others = groups(sortedFile(join,'PERSON_ID'),'PERSON_ID') if join else iter(())
+    other = next(others,None)
+    for pid, rows in groups(sortedFile(src,'PERSON_ID'),'PERSON_ID'):
+      while other and other[0] < pid: other = next(others,None)
+      yield pid, rows, other[1] if other and other[0] == pid else []
+
+def runStage(job):
+    """Writes data file dst from extract src (joined to extract join), a
+patient at a time (in patient id order); returns (data file, rows read, rows
+written, source codes that aren't in the map)"""
+    name, src, join, dst = job
+    header, transform = [(h, t) for n, e, j, h, t in STAGES if n == name][0]
+    out = open(dst+'.tmp','w')
+    writer = csv.writer(out,dialect='excel-tab',lineterminator='\n')
+    writer.writerow(header)
+    read = written = 0
+    unmapped = set()
+    for pid, rows, joined in patients(src,join):
+      read += len(rows)
+      for row in transform(pid,rows,joined,unmapped):
+        writer.writerow(row)
+        written += 1
+    out.close()
+    os.rename(dst+'.tmp',dst)
+    return name, read, written, sorted(unmapped)
+
+def runStages(jobs,processes):
+    """Runs the stages in jobs ((data file, extract, joined extract, output) each) in
+processes workers; yields runStage's results as each stage finishes"""
+    if processes == 1 or len(jobs) < 2:
+      for job in jobs: yield runStage(job)
+      return
+    pool = multiprocessing.Pool(min(processes,len(jobs)))
+    try:
+      for result in pool.imap_unordered(runStage,jobs): yield result
+    finally:
+      pool.close()
+      pool.join()
+
+def _read(path):
+    return csv.DictReader(file(path,'U'),dialect='excel-tab')
+
+def _count(counts,code):
+    counts[code] = counts.get(code,0) + 1
+
+def _choose(counts):
+    """Returns the most common of the codes in counts (code -> matches), or
+None if several are tied for it; and the codes tied for it, sorted"""
+    top = max(counts.values())
+    tied = sorted(code for code in counts if counts[code] == top)
+    return (tied[0] if len(tied) == 1 else None), tied
+
+def _writeMap(filename,header,counts,ambiguous,columns={}):
+    """Writes a map of the most common standard code for each source code
+(and name) in counts, indexed by SOURCE_CODE.  Source codes with several
+codes tied for the most matches aren't mapped: they are added to ambiguous,
+as (source code and name, tied codes, matches).  Any more columns are the
+most common of the values counted in columns[column][(source code, code)]
+(left blank, and added to ambiguous, if tied).  Returns the number of rows."""
+    out = open(filename,'w')
+    writer = csv.writer(out,dialect='excel-tab',lineterminator='\n')
+    writer.writerow(header)
+    rows = 0
+    for key in sorted(counts):
+      code, tied = _choose(counts[key])
+      if code is None:
+        ambiguous.append((key, tied, counts[key][tied[0]]))
+        continue
+      row = list(key)+[code]
+      for column in header[len(row):]:
+        values = columns[column].get(key+(code,))
+        value, tied = _choose(values) if values else ('', [])
+        if value is None:
+          ambiguous.append((key+(column,), tied, values[tied[0]]))
+          value = ''
+        row.append(value)
+      writer.writerow(row)
+      rows += 1
+    out.close()
+    sortFile(filename,filename,'SOURCE_CODE',True)
+    return rows
+
+def learnMaps(data,ri):
+    """Derives the mapping tables from the data files in data and the
+extracts in ri that they were made from, by matching up their rows; yields
+(mapping file, rows, ambiguous source codes (see _writeMap)) as each is
+written"""
+    counts = collections.defaultdict(dict) # (source code, name) -> codes
+    problems = dict(((p['PID'],p['START_DATE'],p['NAME']), p['SNOMED'])
+                    for p in _read(os.path.join(data,os.path.basename(PROBLEMS_FILE))))
+    for r in _read(os.path.join(ri,'ri-conds.txt')):
+      snomed = problems.get((r['PERSON_ID'],r['DX_DATE'],r['DIAGNOSIS']))
+      if snomed: _count(counts[(r['SOURCE_CONDITION_CODE'],r['DIAGNOSIS'])],snomed)
+    ambiguous = []
+    yield ICD9_SNOMED_FILE, _writeMap(ICD9_SNOMED_FILE,('SOURCE_CODE','NAME','SNOMED'),counts,ambiguous), ambiguous
+
+    counts = collections.defaultdict(dict)
+    refills = collections.defaultdict(list)
+    for f in _read(os.path.join(data,os.path.basename(REFILLS_FILE))):
+      refills[(f['PID'],f['DATE'],f['DAYS'],f['Q'])].append(f['RXN'])
+    sigs = dict(((s['PERSON_ID'],s['START_DATE'],s['SOURCE_DRUG_CODE']), s)
+                for s in _read(os.path.join(ri,'ri-sigs.txt')))
+    for r in _read(os.path.join(ri,'ri-meds.txt')):
+      days, q = supply(r,sigs.get((r['PERSON_ID'],r['START_DATE'],r['SOURCE_DRUG_CODE'])))
+      if q == '0': continue # (Not a fill, so too many false matches)
+      for rxn in refills.get((r['PERSON_ID'],r['START_DATE'],days,q),[]):
+        _count(counts[(r['SOURCE_DRUG_CODE'],)],rxn)
+    meds = dict(((m['PT_ID'],m['START_DATE'],m['Name']), m['RxNorm'])
+                for m in _read(os.path.join(data,os.path.basename(MEDS_FILE))))
+    for r in _read(os.path.join(ri,'ri-sigs.txt')):
+      rxn = meds.get((r['PERSON_ID'],r['START_DATE'],r['DRUG']))
+      if rxn: _count(counts[(r['SOURCE_DRUG_CODE'],)],rxn)
+    ambiguous = []
+    yield NDC_RXNORM_FILE, _writeMap(NDC_RXNORM_FILE,('SOURCE_CODE','RXNORM'),counts,ambiguous), ambiguous
+
+    counts = collections.defaultdict(dict)
+    names = collections.defaultdict(dict)   # (source code, LOINC) -> lab names
+    choices = collections.defaultdict(dict) # (source code, LOINC) -> Ord choices
+    labs = collections.defaultdict(list)
+    for l in _read(os.path.join(data,os.path.basename(LABS_FILE))):
+      labs[(l['PID'],l['DATE'])].append(l)
+    for r in _read(os.path.join(ri,'ri-obs.txt')):
+      value = r['OBS_VALUE_AS_STRING']
+      for l in labs.get((r['PERSON_ID'],r['OBS_DATE']),[]):
+        if l['VALUE'] == value or (isNumber(value) and isNumber(l['VALUE'])
+                                   and float(value) == float(l['VALUE'])):
+          _count(counts[(r['TERM_ID'],)],l['LOINC'])
+          _count(names[(r['TERM_ID'],l['LOINC'])],l['NAME'])
+          if l['SCALE'] == 'Ord' and l['LOW']: _count(choices[(r['TERM_ID'],l['LOINC'])],l['LOW'])
+    ambiguous = []
+    yield OBS_LOINC_FILE, _writeMap(OBS_LOINC_FILE,('SOURCE_CODE','LOINC','LAB_NAME','CHOICES'),counts,
+                                    ambiguous,{'LAB_NAME': names, 'CHOICES': choices}), ambiguous
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Raw Extract ETL')
+  parser.add_argument('stages', metavar='file', nargs='*',
+                      help='data files to write (default = all of %s)'%", ".join(s[0] for s in STAGES))
+  parser.add_argument('--ri', metavar='dir', default=RI_PATH,
+                      help='Directory of the raw extracts (default = %s)'%RI_PATH)
+  parser.add_argument('--output', metavar='dir', default=GENERATED_PATH,
+                      help='Directory to write the data files into (default = %s; the curated files in '
+                           'the data directory have more in them than the extracts do)'%GENERATED_PATH)
+  parser.add_argument('--jobs', metavar='N', type=int, default=multiprocessing.cpu_count(),
+                      help='number of stages to run at once (default = the number of CPUs)')
+  parser.add_argument('--learn-maps', metavar='dir', nargs='?', const=DATA_PATH, dest='learn',
+                      help='instead, write the mapping tables, matching the extracts up with the data files '
+                           'made from them in dir (default = the data directory)')
+  args = parser.parse_args()
+  if args.jobs < 1: parser.error("--jobs must be at least 1")
+  for name in args.stages:
+    if not name in [s[0] for s in STAGES]: parser.error("No stage writes %s"%name)
+  if not os.path.isdir(GENERATED_PATH): os.makedirs(GENERATED_PATH) # For the sorted extracts
+
+  if args.learn:
+    for filename, count, ambiguous in learnMaps(args.learn,args.ri):
+      print "%s: %d codes"%(filename,count)
+      if ambiguous:
+        print >>sys.stderr, "%s: %d ambiguous source codes (left out, or the column named left blank), "\
+                            "their matches tied between:"%(filename,len(ambiguous))
+        for key, tied, matches in ambiguous:
+          print >>sys.stderr, "  %s: %s (%d matches each)"%(" ".join(key),", ".join(tied),matches)
+    parser.exit()
+
+  for filename in (ICD9_SNOMED_FILE,NDC_RXNORM_FILE,OBS_LOINC_FILE):
+    if not os.path.exists(filename):
+      parser.error("No mapping table %s: run with --learn-maps to make them"%filename)
+  if not os.path.isdir(args.output): os.makedirs(args.output)
+  jobs = [(name, os.path.join(args.ri,extract), join and os.path.join(args.ri,join), os.path.join(args.output,name))
+          for name, extract, join, header, transform in STAGES if not args.stages or name in args.stages]
+  for name, read, written, unmapped in runStages(jobs,args.jobs):
+    print "%s: %d rows read, %d written"%(name,read,written)
+    if unmapped:
+      print >>sys.stderr, "%s: %d source codes not in the map: %s"%(name,len(unmapped)," ".join(unmapped))
@@ -1,15 +1,24 @@
 from testdata import FAMILYHISTORY_FILE
+import rowindex
 import argparse
 import csv
 
-class FamilyHistory: 
+class FamilyHistory(object): 
     """Create instances of FamilyHistory and maintain FamilyHistory lists by patient ID"""
 
+    __slots__ = ('patientid','relativecode','relativetitle','dateofbirth',
+                 'dateofdeath','problemcode','problemtitle','heightcm')
+
     familyHistories = {} # Dictionary of FamilyHistory lists by patient ID
 
     @classmethod
-    def load(cls):
-        """Loads patient family histories"""
+    def load(cls,pid=None,rows=None):
+        """Loads patient family histories (just those of patient pid, if given,
+taken from rows if they've been read already)"""
+        if pid:
+            if rows is None: rows = rowindex.rows(FAMILYHISTORY_FILE,'PATIENT_ID',pid)
+            for history in rows: cls(history)
+            return
       
         # Loop through family histories and build patient FamilyHistory lists:
         histories = csv.reader(file(FAMILYHISTORY_FILE,'U'),dialect='excel-tab')
@@ -1,4 +1,12 @@
+from testdata import rndName, toEmail
+import argparse
+import hashlib
+import numpy
+import os
 import random
+import sys
+from string import Template
+from datetime import datetime, timedelta
 
 f = """male,2,0.88,90,42
 male,2.5,0.92,92,48
@@ -21,67 +29,68 @@ male,7.5,1.29,106,68
 male,7.75,1.31,106,63
 male,7,1.32,108,69"""
 
-ll = f.split("\n");
-stats = [[float(x) for x in l.split(',')[1:]] for l in ll]
-
-start = stats[0][1]
-finish = stats[-1][1]
-
-def interpolate(t):
-  for i in range(1, len(stats)):
-    if stats[i-1][0] <= t and stats[i][0] > t:
-      return ((t-stats[i-1][0])*1.0 / (stats[i][0]-stats[i-1][0]), stats[i-1], stats[i])
-
-  assert false, "couldn't interpolate %s"%t
+class GrowthCurve(object):
+  """A growth table: rows of age (years), height (m) and systolic and
+diastolic blood pressure, from which vitals are sampled at random ages"""
 
-def fuzz(ratio, t1, t2):
-  ret = []
-  for i in range(len(t1)):
-    v = (1.0-ratio) * t1[i] + 1.0*ratio* t2[i]
-    if i >1:  # don't allow date or height to jitter randomly
-      v += random.gauss(0, (t1[i] - t2[i])/3)
-    ret.append(v)
-  return ret
+  def __init__(self, rows):
+    self.stats = numpy.array(rows, dtype=float)
+    # Ages are sampled between the first row's and the last row's, and
+    # looked up in the rows up to the first one that goes back in age
+    self.start, self.end = self.stats[0][0], self.stats[-1][0]
+    ages = self.stats[:,0]
+    n = 1
+    while n < len(ages) and ages[n] >= ages[n-1]: n += 1
+    self.ages, self.rows = ages[:n], self.stats[:n]
 
+  def sample(self, count, samples, rng):
+    """Returns a (count, samples, 4) array of vitals (age, height, sbp, dbp)
+for count patients, each sampled at random ages, in order of age: the
+neighbouring rows of the table are interpolated, and the blood pressures
+jittered by a third of the difference between them"""
+    t = numpy.sort(rng.uniform(self.start, self.end, (count, samples)), axis=1)
+    i = numpy.searchsorted(self.ages, t, side='right').clip(1, len(self.ages)-1)
+    t1, t2 = self.rows[i-1], self.rows[i]
+    ratio = ((t - t1[...,0]) / (t2[...,0] - t1[...,0]))[...,numpy.newaxis]
+    v = (1.0-ratio) * t1 + ratio * t2
+    # don't allow date or height to jitter randomly
+    v[...,2:] += rng.normal(0, numpy.abs(t1[...,2:] - t2[...,2:])/3)
+    return v
 
-from string import Template
+def read_curves(lines):
+  """Returns the growth curves in lines of gender,age,height,sbp,dbp values
+(in the order of the table above), by gender"""
+  rows = {}
+  for l in lines:
+    if not l.strip(): continue
+    fields = l.strip().split(',')
+    rows.setdefault(fields[0], []).append([float(x) for x in fields[1:]])
+  return dict((gender, GrowthCurve(rows[gender])) for gender in rows)
 
-from datetime import datetime, timedelta
-birthday = datetime.now() - timedelta(days=stats[-1][0]*365)
 def add_years(d1, y):
   return d1 + timedelta(days=365*y)
 
 encounter_types = {"ambulatory": "ambulatory encounter",
         "inpatient": "inpatient encounter"}
 
-def choose_encounter_type():
-    n = random.uniform(0, 1)
-    if n < .25:
-        return "inpatient"
-    return "ambulatory"
-
-
 limbs = {"368209003": "right arm",
         "61396006": "left thigh"}
-def choose_limb():
-    n = random.uniform(0, 1)
-    if n < .8:
-        return "368209003"
-    return "61396006"
 
 methods = { "auscultation": "http://smartplatforms.org/terms/codes/BloodPressureMethod#auscultation",
             "machine": "http://smartplatforms.org/terms/codes/BloodPressureMethod#machine"
 }
-def choose_method():
-    n = random.uniform(0, 1)
-    if n < .5:
-        return "auscultation"
-    return "machine"
-    
-def register_code (code):
-    if code not in codes:
-        codes.append (code)
- 
+
+def choose_visits(count, samples, rng):
+  """Returns (count, samples) arrays of the encounter type, blood pressure
+limb and method of each visit, and whether it measured height (or else
+blood pressure)"""
+  shape = (count, samples)
+  encounter = numpy.where(rng.uniform(0, 1, shape) < .25, "inpatient", "ambulatory")
+  limb = numpy.where(rng.uniform(0, 1, shape) < .8, "368209003", "61396006")
+  method = numpy.where(rng.uniform(0, 1, shape) < .5, "auscultation", "machine")
+  height = rng.uniform(0, 1, shape) < 0.2
+  return encounter, limb, method, height
+
 def getCodeFragment (code):
 
     if code.lower() == "inpatient":
@@ -171,13 +180,15 @@ header = """<?xml version="1.0" encoding="utf-8"?>
 
 </sp:MedicalRecord>
  
-<sp:Demographics>
+"""
+
+demographics = Template("""<sp:Demographics>
  <sp:belongsTo rdf:nodeID="patient"/>
 
  <v:n>
     <v:Name>
-        <v:given-name>Allen</v:given-name>
-        <v:family-name>Vitalis</v:family-name>
+        <v:given-name>$given</v:given-name>
+        <v:family-name>$family</v:family-name>
     </v:Name>
  </v:n>
  
@@ -213,9 +224,9 @@ header = """<?xml version="1.0" encoding="utf-8"?>
     </v:Tel>
  </v:tel>
  
- <foaf:gender>male</foaf:gender>
- <v:bday>%s</v:bday>
- <v:email>allen.vitalis@example.com</v:email>
+ <foaf:gender>$gender</foaf:gender>
+ <v:bday>$bday</v:bday>
+ <v:email>$email</v:email>
  
  <sp:medicalRecordNumber>
    <sp:Code>
@@ -225,7 +236,7 @@ header = """<?xml version="1.0" encoding="utf-8"?>
    </sp:Code>
  </sp:medicalRecordNumber>
 </sp:Demographics>
-"""%birthday.strftime("%Y-%m-%d")
+""")
 
 footer = """</rdf:RDF>"""
 
@@ -867,8 +878,7 @@ vitals_codes = """
   </spcode:VitalSign>
 """
 
-def tordf(v, include_height=False, include_bp=False):
-  h = Template("""<sp:height>
+h_template = Template("""<sp:height>
       <sp:VitalSign>
        <sp:vitalName>
         <sp:CodedValue>
@@ -882,7 +892,7 @@ def tordf(v, include_height=False, include_bp=False):
     </sp:height>
 """)
 
-  bp = Template("""    <sp:bloodPressure>
+bp_template = Template("""    <sp:bloodPressure>
       <sp:BloodPressure>
        <sp:systolic>
          <sp:VitalSign>
@@ -930,7 +940,7 @@ def tordf(v, include_height=False, include_bp=False):
     </sp:bloodPressure>
 """)
 
-  r = Template("""
+set_template = Template("""
  <sp:VitalSignSet>
     <sp:belongsTo rdf:nodeID="patient"/>
     <dcterms:date>$vitals_date</dcterms:date>
@@ -952,59 +962,118 @@ $bp
  </sp:VitalSignSet>
 """)
 
-  et = choose_encounter_type()
-  etn = encounter_types[et]
-  register_code (et)
+def tordf(birthday, v, codes, encounter_type, limb, methodn, include_height):
+  """Renders a VitalSignSet for vitals v (age, height, sbp, dbp), adding the
+codes it uses to codes"""
+  for code in (encounter_type, limb, methodn):
+    if code not in codes: codes.append(code)
 
-  limb = choose_limb()
-  limbn = limbs[limb]
-  register_code (limb)
+  if include_height:
+    h = h_template.substitute(height=v[1] * 100)
+    bp = ""
+  else:
+    h = ""
+    bp = bp_template.substitute(sbp=v[2], dbp=v[3], limb=limb, limbn=limbs[limb],
+                                method=methods[methodn], methodn=methodn)
 
-  methodn = choose_method()
-  method = methods[methodn]
-  register_code (methodn)
+  date = add_years(birthday, v[0]).isoformat()
+  return set_template.substitute(vitals_date=date,
+            encounter_start_date=date,
+            encounter_end_date=date,
+            encounter_type=encounter_type,
+            encounter_type_name=encounter_types[encounter_type],
+            h=h, bp=bp)
 
+# Everything after the patient's codes is the same for every patient, so it
+# is only put together once:
+tail = "\n".join([vitals_codes, medications, problems, procedures, immunizations,
+                  allergies, labs, extravitals, docs, notes, footer])
 
-  if include_height:
-    h = h.substitute(height=v[1] * 100)
-  else: h = ""
+def write_patient(out, name, gender, birthday, vitals, encounter, limb, method, height):
+  """Writes the RDF document of a patient with the given vitals (one
+patient's slices of the arrays from GrowthCurve.sample and choose_visits)
+to file out"""
+  codes = []
+  out.write(header)
+  out.write(demographics.substitute(given=name[0], family=name[2], gender=gender,
+                                    bday=birthday.strftime("%Y-%m-%d"), email=toEmail(name)))
+  out.write("\n")
+  for i in range(len(vitals)):
+    out.write(tordf(birthday, vitals[i].tolist(), codes, encounter[i], limb[i], method[i], height[i]))
+    out.write("\n")
+  out.write(codesToRDF(codes))
+  out.write("\n")
+  out.write(tail)
+  out.write("\n")
 
-  if include_bp:
-    bp = bp.substitute(sbp=v[2], dbp=v[3],  limb=limb, limbn=limbn, method=method,methodn=methodn)
-  else: bp=""
+def write_patients(path, count, samples, males, curves, today, rng, names, batch=1000):
+  """Writes count patients (a fraction males of them male) with samples
+vitals each to files p1.xml, p2.xml, ... in directory path, generating
+the vitals of batch patients at a time"""
+  for first in range(0, count, batch):
+    n = min(batch, count-first)
+    male = rng.uniform(0, 1, n) < males
+    vitals = [None]*n
+    for gender, chosen in (("male", male), ("female", ~male)):
+      index = numpy.flatnonzero(chosen)
+      if len(index):
+        for i, v in zip(index, curves[gender].sample(len(index), samples, rng)): vitals[i] = v
+    visits = choose_visits(n, samples, rng)
+    days = rng.uniform(0, 365, n) # Spread the birthdays over a year
+    for i in range(n):
+      gender = "male" if male[i] else "female"
+      birthday = today - timedelta(days=curves[gender].end*365 + days[i])
+      out = open(os.path.join(path, "p%d.xml"%(first+i+1)), "w")
+      write_patient(out, rndName(gender[0].upper(), names), gender, birthday, vitals[i],
+                    *[a[i] for a in visits])
+      out.close()
 
 
-  return r.substitute(vitals_date=add_years(birthday, v[0]).isoformat(),
-            encounter_start_date=add_years(birthday, v[0]).isoformat(),
-            encounter_end_date=add_years(birthday, v[0]).isoformat(),
-            encounter_type=et,
-            encounter_type_name=etn,
-            h=h, bp=bp)
+parser = argparse.ArgumentParser(description='Generates sample patients with vital sign measurements along a growth curve, as RDF')
+parser.add_argument('--seed', metavar='S',
+                    help='seed the random values, so every run with the same seed (on the same day) writes the same vitals')
+parser.add_argument('--patients', metavar='N', type=int,
+                    help='write N patients, to a file each (p1.xml, p2.xml, ...) in the --output directory, '
+                         'instead of one patient to stdout')
+parser.add_argument('--output', metavar='dir', default='.',
+                    help="directory to write the --patients files to (default='.')")
+parser.add_argument('--samples', metavar='N', type=int, default=50,
+                    help='number of vital sign measurements per patient (default=50)')
+parser.add_argument('--males', metavar='F', type=float,
+                    help='fraction of the patients that are male (default: 0.5, if there are '
+                         'growth tables for both genders)')
+parser.add_argument('--growth-table', metavar='file', action='append',
+                    help='read the growth tables from file, in rows of gender,age,height,sbp,dbp '
+                         '(default: the built-in male table); may be repeated')
+args = parser.parse_args()
+if args.growth_table:
+  curves = {}
+  for name in args.growth_table: curves.update(read_curves(open(name)))
+else: curves = read_curves(f.split("\n"))
+for gender in curves:
+  if not gender in ("male", "female"): parser.error("Unknown gender in growth table: '%s'"%gender)
+if args.males is None:
+  args.males = 0.5 if len(curves) == 2 else (1.0 if "male" in curves else 0.0)
+if not 0 <= args.males <= 1: parser.error("--males must be between 0 and 1")
+if args.males > 0 and not "male" in curves: parser.error("There is no male growth table")
+if args.males < 1 and not "female" in curves: parser.error("There is no female growth table")
+if args.samples < 1: parser.error("--samples must be at least 1")
 
+today = datetime.now()
+if args.seed is not None:
+  rng = numpy.random.RandomState(int(hashlib.sha1(args.seed).hexdigest()[:8], 16))
+  names = random.Random(args.seed)
+  today = today.replace(hour=0, minute=0, second=0, microsecond=0) # Not to the microsecond
+else: rng, names = numpy.random.RandomState(), random
 
-codes = []
-a = []
-for p in range(50):
-  t = random.uniform(stats[0][0], stats[-1][0])
-  r,t1,t2 = interpolate(t)
-  v = fuzz(r,t1,t2)
-  a.append(v)
-
-print header
-a.sort(key=lambda x: x[0])
-for l in a:
-  include_height=(random.random()<0.2)
-  include_bp=not include_height
-  print tordf(l, include_height, include_bp)
-print codesToRDF (codes)
-print vitals_codes
-print medications
-print problems
-print procedures
-print immunizations
-print allergies
-print labs
-print extravitals
-print docs
-print notes
-print footer
+if args.patients is None: # The original sample patient:
+  gender = "male" if args.males >= 0.5 else "female"
+  curve = curves[gender]
+  vitals = curve.sample(1, args.samples, rng)
+  visits = choose_visits(1, args.samples, rng)
+  write_patient(sys.stdout, ("Allen", "", "Vitalis"), gender, today - timedelta(days=curve.end*365),
+                vitals[0], *[a[0] for a in visits])
+else:
+  if args.patients < 1: parser.error("--patients must be at least 1")
+  if not os.path.isdir(args.output): os.makedirs(args.output)
+  write_patients(args.output, args.patients, args.samples, args.males, curves, today, rng, names)
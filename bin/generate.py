@@ -1,5 +1,5 @@
 from rdflib import ConjunctiveGraph, Namespace, BNode, Literal, RDF, URIRef
-from testdata import PATIENTS_FILE
+from testdata import PATIENTS_FILE, setSeed
 import ontology_service 
 from patient import Patient
 from med import Med
@@ -13,13 +13,23 @@ from allergy import Allergy
 from clinicalnote import ClinicalNote
 from socialhistory import SocialHistory
 from familyhistory import FamilyHistory
+from rdfstream import StreamingGraph
+import incremental
+import indivo
+import metrics
+import patientstream
+import profiler
+import snapshot
 import argparse
+import csv
+import multiprocessing
 import sys
 import os
 from common.rdf_tools.util import *
 
 # Some constant strings:
 FILE_NAME_TEMPLATE = "p%s.xml"  # format for output files: p<patient id>.xml
+GENERATOR_VERSION = "1" # Change this when the output changes, so --incremental rewrites everything
 
 SP_DEMOGRAPHICS = "http://smartplatforms.org/records/%s/demographics"
 RXN_URI="http://purl.bioontology.org/ontology/RXNORM/%s"
@@ -67,11 +77,15 @@ class PatientGraph:
      self.g.add((vNode,SP['unit'],Literal(units)))
      return vNode
 
-   def __init__(self,p):
-      """Create an instance of a RDF graph for patient instance p""" 
+   def __init__(self,p,g=None,spliceNotes=False):
+      """Create an instance of a RDF graph for patient instance p;
+an existing (e.g. streaming) graph, g, may be passed in to hold the triples.
+With spliceNotes, clinical notes are spliced into g (a StreamingGraph) from
+pre-serialized fragments""" 
       self.pid=p.pid
+      self.spliceNotes = spliceNotes
       # Create a RDF graph and namespaces:
-      g = ConjunctiveGraph()
+      if g is None: g = ConjunctiveGraph()
       self.g = g  # Keep a reference to this graph as an instance var
 
       # BindNamespaces to the graph:
@@ -189,6 +203,10 @@ class PatientGraph:
    def addClinicalNotes(self):
       """Add notes to a patient's graph"""
       g = self.g
+      if self.spliceNotes: # Copy the notes out as they are, relabeling their blank nodes
+        for fragment, note in ClinicalNote.fragments(self.pid,g.format,g.namespaces):
+          self.addStatement(g.splice(fragment).get(note,note))
+        return
       if not self.pid in ClinicalNote.clinicalNotes: return # No notes to add
       for note in ClinicalNote.clinicalNotes[self.pid]:
         self.addStatement(note.triples((None, RDF.type, SP['ClinicalNote'])).next()[0])
@@ -417,37 +435,147 @@ class PatientGraph:
    def toRDF(self,format="xml"):
          return self.g.serialize(format=format)
 
-def initData():
-   """Load data and mappings from Raw data files and mapping files"""
-   Patient.load()
-   Med.load()
-   Problem.load()
-   Lab.load()
-   Refill.load()
-   VitalSigns.load()
-   Immunization.load()
-   Procedure.load()
-   SocialHistory.load()
-   FamilyHistory.load()
-   ClinicalNote.load()
-   Allergy.load()
-
-def writePatientGraph(f,pid,format):
-   """Writes a patient's RDF out to a file, f"""
+# The sections of a patient's graph, in the order writePatientGraph adds them
+SECTIONS = ('addMedList', 'addProblemList', 'addProcedureList', 'addSocialHistory',
+            'addFamilyHistory', 'addClinicalNotes', 'addLabResults', 'addAllergies',
+            'addVitalSigns', 'addImmunizations')
+
+# The classes that load the data files, in loading order
+SOURCES = (Patient, Med, Problem, Lab, Refill, VitalSigns, Immunization,
+           Procedure, SocialHistory, FamilyHistory, ClinicalNote, Allergy)
+
+def initData(use_snapshot=True,pid=None):
+   """Load data and mappings from Raw data files and mapping files
+(or from the snapshot of them, if it is up to date).  If pid is given, only
+that patient's rows are read, through the row indexes of the data files"""
+   if pid:
+     for cls in SOURCES: cls.load(pid=pid)
+     return
+   if use_snapshot:
+     key = snapshot.inputHash()
+     if snapshot.load(key): return
+   for cls in SOURCES: cls.load()
+   if use_snapshot: snapshot.save(key)
+
+def writePatientGraph(f,pid,format,backend='graph',profile=None):
+   """Writes a patient's RDF out to a file, f.  With the 'stream' backend
+triples are serialized to f as they are added, instead of being collected
+in an rdflib graph and serialized at the end; the 'splice' backend streams
+too, but copies clinical notes out from pre-serialized fragments.  Each
+section (and the serialization, 'toRDF') is recorded in profile, a
+profiler.Profile, if given."""
+   if profile: f = profile.output(f)
    p = Patient.mpi[pid]
-   g = PatientGraph(p)
-   g.addMedList()
-   g.addProblemList()
-   g.addProcedureList()
-   g.addSocialHistory()
-   g.addFamilyHistory()
-   g.addClinicalNotes()
-   g.addLabResults()
-   g.addAllergies()
-   g.addVitalSigns()
-   g.addImmunizations()
-   print >>f, g.toRDF(format=format)
-
+   if backend in ('stream','splice'):
+     g = PatientGraph(p,StreamingGraph(f,format),backend=='splice')
+     finish = g.g.close
+   else:
+     g = PatientGraph(p)
+     def finish(): print >>f, g.toRDF(format=format)
+   for section in SECTIONS:
+     if profile: profile.run(pid,section,g,getattr(g,section))
+     else: getattr(g,section)()
+   if profile: profile.run(pid,'toRDF',g,finish)
+   else: finish()
+
+def writePatientFile(path,pid,format,backend='graph',profile=None):
+   """Writes a patient's RDF out to its own file in directory path"""
+   f = open(path+FILE_NAME_TEMPLATE%pid,'w')
+   writePatientGraph(f,pid,format,backend,profile)
+   f.close()
+
+def _initWorker():
+   """Pool initializer: loads the data unless it was inherited via fork"""
+   if not Patient.mpi: initData()
+
+def _workerProfile(measure):
+   """Returns a profile for a worker to pass its metrics back in, if measure"""
+   if measure: return profiler.Profile(patients=False,metrics=metrics.Metrics())
+
+def _writePatientShard(job):
+   """Pool worker: writes the RDF files for a shard of patient ids; returns
+how many, and the state() of their metrics (if measuring, or else None)"""
+   path, pids, format, backend, measure = job
+   profile = _workerProfile(measure)
+   for pid in pids: writePatientFile(path,pid,format,backend,profile)
+   return len(pids), profile and profile.metrics.state()
+
+def writePatientFiles(path,format,jobs,backend='graph',pids=None,profile=None):
+   """Writes RDF files for all patients (or just pids), sharded across jobs
+processes; yields the number of patients written as each shard completes.
+The workers' metrics are added to profile.metrics, if given."""
+   pids = sorted(Patient.mpi if pids is None else pids)
+   measure = bool(profile and profile.metrics)
+   # Small shards keep the workers evenly loaded and the progress display moving
+   size = max(1, len(pids)/(jobs*8))
+   shards = [(path, pids[i:i+size], format, backend, measure) for i in range(0, len(pids), size)]
+   pool = multiprocessing.Pool(jobs, _initWorker)
+   try:
+     for n, state in pool.imap_unordered(_writePatientShard, shards):
+       if state: profile.metrics.merge(state)
+       yield n
+   finally:
+     pool.close()
+     pool.join()
+
+def streamPatientFiles(path,format,backend='graph',pids=None,profile=None):
+   """Writes RDF files for all patients (or just pids), reading the data
+files a patient at a time (see patientstream) instead of loading them all
+first; yields each patient's id as their file is written"""
+   for pid in patientstream.patients(pids):
+     writePatientFile(path,pid,format,backend,profile)
+     yield pid
+
+def _initIndivoWorker(coded_values):
+   """Pool initializer for the Indivo export: also installs the table of
+coded values resolved by the parent"""
+   _initWorker()
+   indivo.CODED_VALUES.update(coded_values)
+
+def writeIndivoFile(writer,pid,profile=None):
+   """Writes patient pid's Indivo profile with writer, recording the 'render'
+and 'write' stages in profile, if given; returns False if the profile
+already existed"""
+   patient = indivo.IndivoSamplePatient(pid, None)
+   if not profile: return patient.writePatientData(writer,verbose=False)
+   profile.output(writer)
+   docs = profile.run(pid,'render',None,patient.documents)
+   return profile.run(pid,'write',None,writer.write,pid,docs)
+
+def _renderIndivoShard(job):
+   """Pool worker: renders the Indivo documents for a shard of patient ids;
+returns them, and the state() of their metrics (if measuring, or else None)"""
+   pids, measure = job
+   profile = _workerProfile(measure)
+   docs = []
+   for pid in pids:
+     patient = indivo.IndivoSamplePatient(pid, None)
+     if profile: docs.append((pid, profile.run(pid,'render',None,patient.documents)))
+     else: docs.append((pid, patient.documents()))
+   return docs, profile and profile.metrics.state()
+
+def writeIndivoFiles(writer,jobs,profile=None):
+   """Writes Indivo profiles for all patients with writer, rendering them in
+jobs processes; yields (pid, written) as each profile is written (written is
+False if the profile already existed).  The stages are recorded in profile,
+if given (the workers' through profile.metrics)."""
+   pids = sorted(Patient.mpi)
+   measure = bool(profile and profile.metrics)
+   size = max(1, len(pids)/(jobs*8))
+   shards = [(pids[i:i+size], measure) for i in range(0, len(pids), size)]
+   # The coded values are resolved once, here, instead of once per worker
+   pool = multiprocessing.Pool(jobs, _initIndivoWorker, (indivo.codedValueTable(),))
+   if profile: profile.output(writer)
+   try:
+     for shard, state in pool.imap_unordered(_renderIndivoShard, shards):
+       if state: profile.metrics.merge(state)
+       # Only this process writes, so a single archive works too
+       for pid, docs in shard:
+         if profile: yield pid, profile.run(pid,'write',None,writer.write,pid,docs)
+         else: yield pid, writer.write(pid, docs)
+   finally:
+     pool.close()
+     pool.join()
 
 def displayPatientSummary(pid):
    """writes a patient summary to stdout"""
@@ -476,6 +604,11 @@ if __name__=='__main__':
      help="displays patient summary (default is 'all')")
   parser.add_argument('--rdf-format', metavar='rdf_format', nargs='?', default='xml',
           help='RDF serialization format to use (defaults to "xml". Also allowed: "turtle".)')
+  parser.add_argument('--rdf-backend', choices=('graph','stream','splice'), default='graph',
+          help='build an rdflib graph and serialize it ("graph", the default), or '
+               'stream triples straight to the output ("stream"), or stream them and splice '
+               'clinical notes in from pre-serialized fragments ("splice"); '
+               'all produce the same RDF, so their output can be checked against each other')
   group.add_argument('--rdf', metavar='pid', nargs='?', const='1520204',
      help='display RDF for a patient (default=1520204)')
   group.add_argument('--write', metavar='dir', nargs='?', const='.',
@@ -484,12 +617,61 @@ if __name__=='__main__':
      help="writes patient XML files to an Indivo sample data directory dir (default='.')")
   group.add_argument('--patients', action='store_true',
          help='Generates new patient data file (overwrites existing one)')
+  parser.add_argument('--indivo-archive', choices=['tar','zip'],
+         help='with --write-indivo, writes the profiles into a tar or zip archive (indivo.tar/.zip)')
+  parser.add_argument('--archive-per-patient', action='store_true',
+         help='with --indivo-archive, writes an archive per patient (patient_<pid>.tar/.zip) instead')
+  parser.add_argument('--incremental', action='store_true',
+         help='with --write, only writes the patients whose data changed since the last --incremental run (and deletes those removed)')
+  parser.add_argument('--streaming', action='store_true',
+         help='with --write, reads the data files a patient at a time, so memory use is bounded '
+              'by the largest patient rather than the whole data set (implies --no-snapshot)')
+  parser.add_argument('--no-snapshot', dest='snapshot', action='store_false',
+         help='always parse the data files, ignoring (and not writing) the snapshot cache')
+  parser.add_argument('--jobs', metavar='N', type=int, default=1,
+         help='number of worker processes to use with --write or --write-indivo (default=1)')
+  parser.add_argument('--seed', metavar='S',
+         help='seed the generated values (names, addresses, accession numbers, etc.), '
+              'so every run with the same seed writes the same data')
+  parser.add_argument('--profile', metavar='N', type=int, nargs='?', const=10,
+         help='with --write, --write-indivo or --rdf, times each section of the patients (with the triples and '
+              'bytes each adds) and prints the totals by section and the N slowest patients (default N=10)')
+  parser.add_argument('--profile-dump', metavar='dir',
+         help='with --profile, also runs each section under cProfile, writing its stats to dir/<section>.prof')
+  parser.add_argument('--metrics', metavar='file',
+         help='with --write or --write-indivo, appends snapshots of the progress (patients written, throughput, '
+              'ETA, triples and bytes written, memory, stage latency histograms) to file, as JSON lines')
+  parser.add_argument('--metrics-prom', metavar='file',
+         help='with --write or --write-indivo, writes the snapshots to file in the Prometheus textfile collector '
+              'format (e.g. <node_exporter textfile directory>/smart_generator.prom)')
+  parser.add_argument('--metrics-interval', metavar='seconds', type=float, default=10.0,
+         help='seconds between the --metrics and --metrics-prom snapshots (default=10)')
 
   args = parser.parse_args()
+  setSeed(args.seed)
+  if args.jobs < 1:
+    parser.error("--jobs must be at least 1")
+  if args.rdf_backend != 'graph' and not args.rdf_format in ('xml','turtle'):
+    parser.error("The %s backend only writes 'xml' or 'turtle'"%args.rdf_backend)
+  if args.archive_per_patient and not args.indivo_archive:
+    parser.error("--archive-per-patient needs --indivo-archive")
+  if args.streaming and args.jobs > 1:
+    parser.error("--streaming writes the patients one at a time: it can't be used with --jobs")
+  if args.profile_dump and args.profile is None:
+    parser.error("--profile-dump needs --profile")
+  if args.profile is not None and args.jobs > 1:
+    parser.error("--profile times the patients one at a time: it can't be used with --jobs")
+  if args.metrics_interval <= 0: parser.error("--metrics-interval must be more than 0")
+  progress = None
+  if args.metrics or args.metrics_prom:
+    progress = metrics.Metrics(args.metrics,args.metrics_prom,args.metrics_interval)
+  profile = None
+  if args.profile is not None or progress:
+    profile = profiler.Profile(args.profile_dump,args.profile is not None,progress)
 
   # Print a patient summary: 
   if args.summary:
-    initData()
+    initData(args.snapshot,None if args.summary=='all' else args.summary)
     if args.summary=='all': # Print a summary of all patients
       for pid in Patient.mpi: displayPatientSummary(pid)
       parser.exit()
@@ -501,44 +683,97 @@ if __name__=='__main__':
  
   # Display a single patient's RDF
   if args.rdf:
-    initData()
+    initData(args.snapshot,args.rdf)
     if not args.rdf in Patient.mpi:
       parser.error("Patient ID = %s not found."%args.rdf)
     else:
-      writePatientGraph(sys.stdout,args.rdf, args.rdf_format)
+      writePatientGraph(sys.stdout,args.rdf, args.rdf_format, args.rdf_backend, profile)
+      if args.profile is not None: profile.report(sys.stderr,args.profile)
       parser.exit()
  
   # Write all patient RDF files out to a directory
   if args.write:
     print "Writing files to %s:"%args.write
-    initData()
     path = args.write
     if not os.path.exists(path):
       parser.error("Invalid path: '%s'.Path must already exist."%path)
     if not path.endswith('/'): path = path+'/' # Works with DOS? Who cares??
-    for pid in Patient.mpi:
-      f = open(path+FILE_NAME_TEMPLATE%pid,'w')
-      writePatientGraph(f,pid,args.rdf_format)
-      f.close()
-      # Show progress with '.' characters
-      print ".", 
-      sys.stdout.flush()
-    parser.exit(0,"\nDone writing %d patient RDF files!"%len(Patient.mpi))
+    if args.streaming: # Just the patient ids, for now
+      everyone = [p['PID'] for p in csv.DictReader(file(PATIENTS_FILE,'U'),dialect='excel-tab')]
+    else:
+      initData(args.snapshot)
+      everyone = Patient.mpi.keys()
+    ontology_service.warm() # Before any workers are forked, so they share it
+    pids = everyone
+    if args.incremental:
+      # Skip the patients whose fingerprint matches the manifest (if their file is still there)
+      fingerprints = incremental.fingerprints(" ".join((GENERATOR_VERSION,args.rdf_format,args.rdf_backend,
+                                                       "seed=%s"%args.seed)))
+      manifest = incremental.loadManifest(path)
+      pids = [pid for pid in pids if manifest.get(pid) != fingerprints.get(pid)
+              or not os.path.exists(path+FILE_NAME_TEMPLATE%pid)]
+      present = set(everyone)
+      removed = [pid for pid in manifest if not pid in present]
+      for pid in removed:
+        if os.path.exists(path+FILE_NAME_TEMPLATE%pid): os.remove(path+FILE_NAME_TEMPLATE%pid)
+    if progress: progress.start(len(pids))
+    if args.streaming:
+      for pid in streamPatientFiles(path,args.rdf_format,args.rdf_backend,set(pids),profile):
+        print ".",
+        sys.stdout.flush()
+        if progress: progress.patients()
+    elif args.jobs == 1:
+      for pid in pids:
+        writePatientFile(path,pid,args.rdf_format,args.rdf_backend,profile)
+        # Show progress with '.' characters
+        print ".", 
+        sys.stdout.flush()
+        if progress: progress.patients()
+    else:
+      # Workers are forked after initData(), so they share the loaded tables
+      for n in writePatientFiles(path,args.rdf_format,args.jobs,args.rdf_backend,pids,profile):
+        print ". "*n,
+        sys.stdout.flush()
+        if progress: progress.patients(n)
+    if progress: progress.finish()
+    if args.profile is not None: profile.report(sys.stdout,args.profile)
+    if args.incremental:
+      incremental.saveManifest(path,dict((pid, fingerprints[pid]) for pid in everyone))
+      parser.exit(0,"\nDone writing %d patient RDF files (%d unchanged, %d removed)!"%(
+        len(pids),len(everyone)-len(pids),len(removed)))
+    parser.exit(0,"\nDone writing %d patient RDF files!"%len(everyone))
 
   # Write all patient RDF files out to a directory
   if args.writeIndivo:
     print "Writing files to %s:"%args.writeIndivo
-    initData()
+    initData(args.snapshot)
+    ontology_service.warm()
     path = args.writeIndivo
     if not os.path.exists(path):
       parser.error("Invalid path: '%s'.Path must already exist."%path)
 
-    import indivo
-
-    for pid in Patient.mpi:
-      indivo.IndivoSamplePatient(pid, path).writePatientData()
+    if args.indivo_archive and not args.archive_per_patient:
+      archive = os.path.join(path,"%s.%s"%(indivo.RUN_ARCHIVE_NAME,args.indivo_archive))
+      if os.path.exists(archive):
+        parser.error("Archive '%s' already exists."%archive)
+    writer = indivo.writer(path,args.indivo_archive,args.archive_per_patient)
+    if progress: progress.start(len(Patient.mpi))
+    if args.jobs == 1:
+      written = ((pid, writeIndivoFile(writer,pid,profile)) for pid in Patient.mpi)
+    else: written = writeIndivoFiles(writer,args.jobs,profile)
+    skipped = []
+    for pid, ok in written:
+      if not ok: skipped.append(pid)
+      # Show progress with '.' characters
+      print ".",
       sys.stdout.flush()
-    parser.exit(0,"Done writing %d patient data profiles!\n"%len(Patient.mpi))
+      if progress: progress.patients()
+    writer.close()
+    if progress: progress.finish()
+    if args.profile is not None: profile.report(sys.stdout,args.profile)
+    if skipped:
+      print "\nSkipped %d patients whose profiles already exist: %s"%(len(skipped)," ".join(skipped)),
+    parser.exit(0,"\nDone writing %d patient data profiles!\n"%(len(Patient.mpi)-len(skipped)))
 
   # Generate a new patients data file, re-randomizing old names, dob, etc:
   Patient.generate()  
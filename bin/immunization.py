@@ -1,17 +1,27 @@
 from testdata import IMMUNIZATIONS_FILE
+from records import Record
+import rowindex
 import argparse
 import csv
 
 
-class Immunization: 
-    """Create instances of Immunization list entries; 
-also maintains complete Immunization lists by patient id"""
+class Immunization(Record): 
+    """Create instances of Immunization list entries (with an attribute for
+each column of the immunizations file); also maintains complete
+Immunization lists by patient id"""
+
+    __slots__ = ()
 
     immunizations = {} # Dictionary of Immunization lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Immunization observations"""
+    def load(cls,pid=None,rows=None):
+      """Loads patient Immunization observations (just those for patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(IMMUNIZATIONS_FILE,'PID',pid)
+        for i in rows: cls(i)
+        return
       
       # Loop through Immunizations and build patient Immunizations lists:
       iis = csv.reader(file(IMMUNIZATIONS_FILE,'U'),dialect='excel-tab')
@@ -20,19 +30,13 @@ also maintains complete Immunization lists by patient id"""
           cls(dict(zip(header,i))) # Create a Immunization instance (saved in Immunizations.immunizations)
 
     def __init__(self,m):
-        for f in m:
-            setattr(self, f.lower(), m[f])
-
-        self.sourcerow = m
+        Record.__init__(self,m)
 
         # Append Immunization to the patient's Immunization list:
         if self.pid in  self.__class__.immunizations:
           self.__class__.immunizations[self.pid].append(self)
         else: self.__class__.immunizations[self.pid] = [self]
 
-    def asTabString(self):
-        return self.sourcerow
-
 if __name__== '__main__':
   print "As main"
   parser = argparse.ArgumentParser(description='Test Data Vitals Module')
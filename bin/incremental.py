@@ -0,0 +1,73 @@
+"""Per-patient fingerprints of the input data, and the manifest of them kept
+with a directory of output files, so only the patients whose inputs changed
+need to be written again"""
+from testdata import DATA_PATH, NOTES_PATH, LOINC_FILE, PID_FIELDS
+import csv
+import hashlib
+import os
+
+MANIFEST_NAME = "manifest.txt" # Kept in the output directory
+
+def fingerprints(version=''):
+   """Returns a dictionary of fingerprints by patient id, each a hash of
+version, the patient's rows in every data file and their clinical notes.
+Changes to files without patient rows (e.g. the LOINC map) change every
+fingerprint."""
+   common = hashlib.sha1(version+'\0')
+   hashes = {}
+   def patient(pid):
+     if not pid in hashes: hashes[pid] = hashlib.sha1()
+     return hashes[pid]
+
+   for name in sorted(os.listdir(DATA_PATH)):
+     path = os.path.join(DATA_PATH,name)
+     if not name.endswith('.txt') or not os.path.isfile(path): continue
+     rows = csv.reader(file(path,'U'),dialect='excel-tab')
+     header = rows.next()
+     columns = [i for i, f in enumerate(header) if f in PID_FIELDS]
+     if not columns:
+       common.update(_fileHash(path))
+       continue
+     c = columns[0]
+     for row in rows:
+       if len(row) <= c: continue
+       patient(row[c]).update("%s\t%s\n"%(name,"\t".join(row)))
+
+   if os.path.isdir(NOTES_PATH):
+     for pid in os.listdir(NOTES_PATH):
+       notes = os.path.join(NOTES_PATH,pid)
+       if not os.path.isdir(notes): continue
+       for name in sorted(os.listdir(notes)):
+         patient(pid).update("notes/%s\0%s"%(name,_fileHash(os.path.join(notes,name))))
+
+   common.update(_fileHash(LOINC_FILE))
+   common = common.hexdigest()
+   return dict((pid, hashlib.sha1(common+h.hexdigest()).hexdigest())
+               for pid, h in hashes.items())
+
+def _fileHash(path):
+   h = hashlib.sha1()
+   f = open(path,'rb')
+   for block in iter(lambda: f.read(1<<20), ''): h.update(block)
+   f.close()
+   return h.hexdigest()
+
+def loadManifest(path):
+   """Returns the fingerprints recorded in directory path ({} if none)"""
+   manifest = {}
+   try:
+     f = open(os.path.join(path,MANIFEST_NAME))
+   except IOError: return manifest
+   for line in f:
+     fields = line.rstrip('\n').split('\t')
+     if len(fields) == 2: manifest[fields[0]] = fields[1]
+   f.close()
+   return manifest
+
+def saveManifest(path,manifest):
+   """Records the fingerprints in manifest in directory path"""
+   name = os.path.join(path,MANIFEST_NAME)
+   f = open(name+'.tmp','w')
+   for pid in sorted(manifest): print >>f, "%s\t%s"%(pid,manifest[pid])
+   f.close()
+   os.rename(name+'.tmp',name)
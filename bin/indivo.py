@@ -4,11 +4,15 @@ from med import Med
 from problem import Problem
 from refill import Refill
 from lab import Lab
-from immunizations import Immunizations
+from immunization import Immunization
 from vitals import VitalSigns
+from cStringIO import StringIO
 import ontology_service
 import os
 import rdflib
+import tarfile
+import time
+import zipfile
                 
 class IndivoSamplePatient(object):
     """ Represents all of a patient's sample data in Indivo-compatible formats."""
@@ -33,29 +37,27 @@ class IndivoSamplePatient(object):
         self.addVitals()
         self.populated_p = True
         
-    def writePatientData(self):
-        """Write a patient's data to an Indivo sample data profile under self.output_dir."""
-        print "adding SMART data to data profile %s: %s"%(self.pid, self.fullname)
-        
+    def documents(self):
+        """ Returns the patient's Indivo documents, as a list of (file name, document) pairs. """
         if not self.populated_p:
             self._populate()
-            
-        # create a directory for the patient
-        OUTPUT_DIR = os.path.join(self.output_dir, "patient_%s"%self.pid)
-        try:
-            os.mkdir(OUTPUT_DIR)
-
-            # create a demographics file
-            with open(os.path.join(OUTPUT_DIR, "Demographics.xml"), 'w') as demo:
-                demo.write(self.demographics_doc)
-
-            # create the rest of the data:
-            for i, doc in enumerate(self.data):
-                with open(os.path.join(OUTPUT_DIR, "doc_%s.xml"%i), 'w') as d:
-                    d.write(doc)
-
-        except OSError:
-            print "Patient with id %s already exists, skipping..."%self.pid
+        docs = [("Demographics.xml", self.demographics_doc)]
+        docs.extend(("doc_%s.xml"%i, doc) for i, doc in enumerate(self.data))
+        return docs
+
+    def writePatientData(self, writer=None, verbose=True):
+        """Write a patient's data to an Indivo sample data profile under self.output_dir
+        (or with *writer*, e.g. into an archive). Returns False if the profile already exists."""
+        if verbose:
+            print "adding SMART data to data profile %s: %s"%(self.pid, self.fullname)
+        if writer is None:
+            writer = DirectoryWriter(self.output_dir)
+
+        if not writer.write(self.pid, self.documents()):
+            if verbose:
+                print "Patient with id %s already exists, skipping..."%self.pid
+            return False
+        return True
     
     def addDemographics(self):
         """ Add demographics to the patient's data. """
@@ -74,7 +76,7 @@ class IndivoSamplePatient(object):
            'region': p.region,
            'street': p.street,
         }
-        self.demographics_doc = DEMOGRAPHICS.sub(demographics_data).done()
+        self.demographics_doc = DEMOGRAPHICS.render(demographics_data)
 
     def addLabs(self):
         """ Add labs to the patient's data. """
@@ -87,10 +89,10 @@ class IndivoSamplePatient(object):
                         'low_val': l.low,
                         'high_val': l.high,
                         }
-                    result_str = QRESULTS.sub(result_data).done()
+                    result_str = QRESULTS.render(result_data)
                 elif l.scale == 'Ord':
                     result_data = {'val': l.value,}
-                    result_str = NRESULTS.sub(result_data).done()
+                    result_str = NRESULTS.render(result_data)
                 else:
                     # no results, don't add this lab
                     continue
@@ -101,22 +103,22 @@ class IndivoSamplePatient(object):
                     'date': l.date,
                     'acc_num': l.acc_num,
                     }
-                lab_str = LAB.sub(lab_data).sub({'results': result_str}, escape=False).done()
-                self.data.append(SDMX.sub({'models':lab_str}, escape=False).done())
+                lab_str = LAB.render(lab_data, {'results': result_str})
+                self.data.append(SDMX.render(raw={'models':lab_str}))
                         
     def addProblems(self):
         """ Add problems to the patient's data. """
         if self.pid in Problem.problems: 
             for prob in Problem.problems[self.pid]:
                 subs = {'end': {'end': '2010-09-13'}}
-                self._set_default_attrs(prob, subs)
-                prob_string = PROBLEM.sub({
+                prob = self._with_defaults(prob, subs)
+                prob_string = PROBLEM.render({
                         'onset':prob.start,
                         'resolution':prob.end,
                         'snomed':prob.snomed, 
                         'name':prob.name
-                        }).done()
-                self.data.append(SDMX.sub({'models':prob_string}, escape=False).done())
+                        })
+                self.data.append(SDMX.render(raw={'models':prob_string}))
 
     def addMeds(self):
         """ Add medications to the patient's data. """
@@ -141,10 +143,10 @@ class IndivoSamplePatient(object):
                     'prov_ln': {'prov_ln': 'Mandel'},
                     'prov_tel': {'prov_tel': '1-234-567-8910'},
                     }
-                fills_str = ''
+                fills = []
                 for f in Refill.refill_list(self.pid, m.rxn):
-                    self._set_default_attrs(f, subs)
-                    fills_str = '\n'.join([fills_str, FULFILLMENT.sub({
+                    f = self._with_defaults(f, subs)
+                    fills.append(FULFILLMENT.render({
                                     'date': f.date,
                                     'days': f.days,
                                     'pbm': f.pbm,
@@ -162,7 +164,8 @@ class IndivoSamplePatient(object):
                                     'prov_ln': f.prov_ln,
                                     'prov_tel': f.prov_tel,
                                     'quantity': f.q,
-                                    'quantityUnits': f.qunit}).done()])
+                                    'quantityUnits': f.qunit}))
+                fills_str = ''.join('\n' + fill for fill in fills)
 
                 # build the med, setting some defaults
                 subs = {
@@ -171,7 +174,7 @@ class IndivoSamplePatient(object):
                     'prov': {'prov': 'Derived by prescription', 'prov_id': 'prescription'},
                     'end': {'end': '2010-04-09'},
                     }
-                self._set_default_attrs(m, subs)
+                m = self._with_defaults(m, subs)
                 med_data = {
                     'name': m.name,
                     'rxnorm': m.rxn,
@@ -185,19 +188,19 @@ class IndivoSamplePatient(object):
                     'quantityUnits': m.qttunit,
                     'startDate': m.start,
                     }
-                med_str = MEDICATION.sub(med_data).sub({'fills':fills_str}, escape=False).done()                                          
-                self.data.append(SDMX.sub({'models':med_str}, escape=False).done())
+                med_str = MEDICATION.render(med_data, {'fills':fills_str})
+                self.data.append(SDMX.render(raw={'models':med_str}))
     
     def addAllergies(self):
         """ Add allergies to the patient's data. Bogus data--doesn't read from an allergy file."""
         if int(self.pid)%100 < 85: # no allergies for ~ 85%
-            exclusion = NO_ALLERGY.sub({
+            exclusion = NO_ALLERGY.render({
                     'exclusion':"no known allergies",
                     'exclusion_id':"160244002",
-                    }).done()
-            self.data.append(SDMX.sub({'models':exclusion}, escape=False).done())
+                    })
+            self.data.append(SDMX.render(raw={'models':exclusion}))
         else: # Sprinkle in some sulfa allergies
-            al = DRUG_CLASS_ALLERGY.sub({
+            al = DRUG_CLASS_ALLERGY.render({
                     'reaction': "skin rash",
                     'reaction_id': "271807003",
                     'category': "drug allergy",
@@ -206,11 +209,11 @@ class IndivoSamplePatient(object):
                     'allergen_id': "N0000175503",
                     'severity': "mild",
                     'severity_id': "255604002",
-                    }).done()
-            self.data.append(SDMX.sub({'models':al}, escape=False).done())
+                    })
+            self.data.append(SDMX.render(raw={'models':al}))
             
             if int(self.pid)%2: # and throw in peanut allergies for every other patient
-                al = FOOD_ALLERGY.sub({
+                al = FOOD_ALLERGY.render({
                         'reaction': "anaphylaxis",
                         'reaction_id': "39579001",
                         'category': "food allergy",
@@ -219,13 +222,13 @@ class IndivoSamplePatient(object):
                         'allergen_id': "QE1QX6B99R",
                         'severity': "severe",
                         'severity_id': "24484000",
-                        }).done()
-            self.data.append(SDMX.sub({'models':al}, escape=False).done())
+                        })
+            self.data.append(SDMX.render(raw={'models':al}))
 
     def addImmunizations(self):
         """ Add immunizations to the patient's data. """
-        if self.pid in Immunizations.immunizations:
-            for i in Immunizations.immunizations[self.pid]:
+        if self.pid in Immunization.immunizations:
+            for i in Immunization.immunizations[self.pid]:
                 tmp, adm_status, adm_status_id = self.coded_value(i.administration_status)
                 tmp, prod_class_id = i.vg.rsplit("#", 1) if i.vg else ('', '')
                 prod_class = i.vg_title or ''
@@ -234,7 +237,7 @@ class IndivoSamplePatient(object):
                 tmp, prod_name_id = i.cvx.rsplit("#", 1)
                 prod_name = i.cvx_title
                 tmp, ref, ref_id = self.coded_value(i.refusal_reason) if i.refusal_reason else ('', '', '')
-                i_str = IMMUNIZATION.sub({
+                i_str = IMMUNIZATION.render({
                         'date': i.date,
                         'adm_status': adm_status,
                         'adm_status_id': adm_status_id,
@@ -246,8 +249,8 @@ class IndivoSamplePatient(object):
                         'prod_name_id': prod_name_id,
                         'ref': ref,
                         'ref_id': ref_id,
-                        }).done()
-                self.data.append(SDMX.sub({'models':i_str}, escape=False).done())
+                        })
+                self.data.append(SDMX.render(raw={'models':i_str}))
 
     def addVitals(self):
         """ Add vitals to the patient's data. """
@@ -263,17 +266,16 @@ class IndivoSamplePatient(object):
             if hasattr(v, vt['name']):
                 val = getattr(v, vt['name'])
                 sys, title, ident = self.coded_value(vt['uri'])
-                return VITAL_SIGN.sub(
+                return VITAL_SIGN.render(
                     {'unit': vt['unit'],
                      'val': val,
                      'name_title': title,
                      'name_id': ident,
                      'name_system': sys
-                     }
-                    ).sub(
-                    {'prefix': vt['indivo_prefix'] if 'indivo_prefix' in vt else vt['name']},                     
-                    escape=False
-                    ).done()
+                     },
+                    {'prefix': vt['indivo_prefix'] if 'indivo_prefix' in vt else vt['name']}
+                    )
+            return '' # Not measured (no such column in the vitals file)
 
         def cleanVitalsDate(date_str):
             """ Convert dates coming from raw Vitals data into UTC ISO8601 Timestamps."""
@@ -291,50 +293,199 @@ class IndivoSamplePatient(object):
                     measurements.append(getBP(VitalSigns.systolic))
                     measurements.append(getBP(VitalSigns.diastolic))
 
-                encounter_str = ENCOUNTER.sub(
+                encounter_str = ENCOUNTER.render(
                     {'start':cleanVitalsDate(v.start_date),
                      'end':cleanVitalsDate(v.end_date)
-                     }
-                    ).sub(
-                    {'encounterType':ENCOUNTER_TYPE.done() if v.encounter_type == 'ambulatory' else ''}, 
-                    escape=False
-                    ).done()
+                     },
+                    {'encounterType':ENCOUNTER_TYPE.render() if v.encounter_type == 'ambulatory' else ''}
+                    )
 
-                vitals_str = VITAL_SIGNS.sub(
+                vitals_str = VITAL_SIGNS.render(
                     {'date': cleanVitalsDate(v.timestamp),
-                     }
-                    ).sub(
+                     },
                     {'encounter': encounter_str,
-                     'vitals_str': ''.join(measurements)}, 
-                    escape=False
-                    ).done()
-                self.data.append(SDMX.sub({'models':vitals_str}, escape=False).done())
+                     'vitals_str': ''.join(measurements)}
+                    )
+                self.data.append(SDMX.render(raw={'models':vitals_str}))
 
     def coded_value(self, raw_uri):
         """ Look up a URI in the ontology service. """
-        g = rdflib.Graph()
-        uri = rdflib.URIRef(raw_uri)
-        cv = ontology_service.coded_value(g, rdflib.URIRef(uri))
-        title = str(list(g.triples((uri, DCTERMS.title, None)))[0][2])
-        sep = "#" if "#" in str(uri) else "/"
-        sys, ident = str(uri).rsplit(sep, 1)
-        return (sys+sep, title, ident)
-
-    def _set_default_attrs(self, obj, subs):
-        """ Set default attributes defined in *subs* on *obj* if they don't exist. """
+        return coded_value(raw_uri)
+
+    def _with_defaults(self, obj, subs):
+        """ Returns *obj*, with the default attributes defined in *subs* for those it doesn't have. """
+        attrs = {}
         for attr_name, attr_subs in subs.iteritems():
             if not getattr(obj, attr_name, None):
-                for newattr_name, newattr_val in attr_subs.iteritems():
-                    setattr(obj, newattr_name, newattr_val)
-
-class ChainableTemplate(Template):
-    def sub(self, data_dict={}, escape=True):
-        if escape:
-            data_dict = dict((key, self._cdata(value)) for key, value in data_dict.iteritems())    
-        return ChainableTemplate(self.safe_substitute(**data_dict))
-            
-    def done(self):
-        return self.template
+                attrs.update(attr_subs)
+        return WithDefaults(obj, attrs) if attrs else obj
+
+class WithDefaults(object):
+    """ Read-only view of an object (a record, which can't take new attributes) with some attributes added or replaced. """
+    def __init__(self, obj, attrs):
+        self._obj = obj
+        self._attrs = attrs
+
+    def __getattr__(self, name):
+        if name in self._attrs:
+            return self._attrs[name]
+        return getattr(self._obj, name)
+
+class DirectoryWriter(object):
+    """ Writes each patient's documents to files in a directory of their own. """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.size = 0 # Bytes written
+
+    def write(self, pid, docs):
+        """ Writes *docs*, unless the patient's directory already exists; returns whether it did.
+        The patient's documents are all encoded first and then written out in one batch, each
+        with a bare open/write/close: no file object or write buffer is set up per document. """
+        patient_dir = os.path.join(self.output_dir, PATIENT_NAME%pid)
+        try:
+            os.mkdir(patient_dir)
+        except OSError:
+            return False
+        batch = [(os.path.join(patient_dir, name), _encode(doc)) for name, doc in docs]
+        for path, doc in batch:
+            fd = os.open(path, FILE_FLAGS, 0666)
+            try:
+                written = os.write(fd, doc)
+                while written < len(doc): # (Only if the write was cut short)
+                    written += os.write(fd, buffer(doc, written))
+            finally:
+                os.close(fd)
+            self.size += len(doc)
+        return True
+
+    def close(self):
+        pass
+
+class ArchiveWriter(object):
+    """ Writes patients' documents into tar or zip archives: an archive per patient (patient_<pid>.tar),
+    or one for the whole run (indivo.tar) with a patient_<pid>/ directory per patient. """
+    def __init__(self, output_dir, format='tar', per_patient=False):
+        assert format in ARCHIVE_FORMATS, "Unknown archive format: %s"%format
+        self.output_dir = output_dir
+        self.format = format
+        self.per_patient = per_patient
+        self.size = 0 # Bytes of documents written
+        self.archive = None
+        if not per_patient:
+            self.archive = self._open(self.path(RUN_ARCHIVE_NAME))
+
+    def path(self, name):
+        """ Returns the path of archive *name* """
+        return os.path.join(self.output_dir, "%s.%s"%(name, self.format))
+
+    def write(self, pid, docs):
+        """ Writes *docs*, unless the patient's archive already exists; returns whether it did. """
+        if not self.per_patient:
+            self._add(self.archive, PATIENT_NAME%pid + '/', docs)
+            return True
+        if os.path.exists(self.path(PATIENT_NAME%pid)):
+            return False
+        archive = self._open(self.path(PATIENT_NAME%pid))
+        try:
+            self._add(archive, '', docs)
+        finally:
+            self._close(archive)
+        return True
+
+    def close(self):
+        if self.archive:
+            self._close(self.archive)
+            self.archive = None
+
+    def _open(self, path):
+        f = open(path, 'wb', WRITE_BUFFER)
+        if self.format == 'zip':
+            return (f, zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED))
+        return (f, tarfile.open(fileobj=f, mode='w'))
+
+    def _close(self, archive):
+        f, a = archive
+        a.close() # (which leaves f open)
+        f.close()
+
+    def _add(self, archive, prefix, docs):
+        a, now = archive[1], time.time()
+        for name, doc in docs:
+            doc = _encode(doc)
+            self.size += len(doc)
+            if self.format == 'zip':
+                info = zipfile.ZipInfo(prefix + name, time.localtime(now)[:6])
+                info.external_attr = 0644 << 16
+                a.writestr(info, doc)
+            else:
+                info = tarfile.TarInfo(prefix + name)
+                info.size, info.mtime, info.mode = len(doc), now, 0644
+                a.addfile(info, StringIO(doc))
+
+def coded_value(raw_uri):
+    """ Returns (system, title, identifier) for a code URI, from CODED_VALUES or the ontology service. """
+    if not raw_uri in CODED_VALUES:
+        types, sys, ident, title = ontology_service.code_info(raw_uri)
+        CODED_VALUES[raw_uri] = (str(sys), str(title), str(ident))
+    return CODED_VALUES[raw_uri]
+
+def codedValueTable():
+    """ Resolves every code URI the vitals and immunizations use into CODED_VALUES; returns the table. """
+    uris = [vt['uri'] for vt in VitalSigns.vitalTypes + [VitalSigns.systolic, VitalSigns.diastolic]]
+    for iis in Immunization.immunizations.values():
+        for i in iis:
+            uris.append(i.administration_status)
+            if i.refusal_reason:
+                uris.append(i.refusal_reason)
+    for uri in uris:
+        coded_value(uri)
+    return CODED_VALUES
+
+def writer(output_dir, archive=None, per_patient=False):
+    """ Returns the writer for Indivo profiles in *output_dir*: into directories, or
+    (if *archive* is 'tar' or 'zip') into archives, per patient or for the whole run. """
+    if archive:
+        return ArchiveWriter(output_dir, archive, per_patient)
+    return DirectoryWriter(output_dir)
+
+def _encode(doc):
+    return doc.encode('utf-8') if isinstance(doc, unicode) else doc
+
+class CompiledTemplate(object):
+    """ A string.Template parsed once into literal text and $slots, which renders in a single pass. """
+    def __init__(self, template):
+        self.template = template
+        self.literals = [] # Literal text before each slot, and after the last one
+        self.slots = []    # (name, placeholder text) for each slot
+        literal, pos = [], 0
+        for m in Template.pattern.finditer(template):
+            literal.append(template[pos:m.start()])
+            pos = m.end()
+            name = m.group('named') or m.group('braced')
+            if m.group('escaped') is not None:
+                literal.append(Template.delimiter)
+            elif name:
+                self.literals.append(''.join(literal))
+                self.slots.append((name, m.group()))
+                literal = []
+            else: # Not a placeholder: keep it as it is, like safe_substitute()
+                literal.append(m.group())
+        literal.append(template[pos:])
+        self.literals.append(''.join(literal))
+
+    def render(self, data={}, raw={}):
+        """ Fill the slots with the values in *data*, as CDATA, and in *raw* (e.g. nested documents), as they are.
+        Slots without a value keep their placeholder. """
+        out = [self.literals[0]]
+        for (name, placeholder), literal in zip(self.slots, self.literals[1:]):
+            if name in raw:
+                out.append('%s'%raw[name])
+            elif name in data:
+                out.append(self._cdata(data[name]))
+            else:
+                out.append(placeholder)
+            out.append(literal)
+        return ''.join(out)
 
     def _cdata(self, data_str):
         return "<![CDATA[%s]]>"%data_str
@@ -343,15 +494,25 @@ class ChainableTemplate(Template):
 # Constants and Templates #
 ###########################
 
+# Coded values: uri -> (system, title, identifier).  A plain dictionary, so
+# it can be built once and handed to every worker process.
+CODED_VALUES = {}
+
+PATIENT_NAME = "patient_%s" # Name of a patient's directory (or archive)
+RUN_ARCHIVE_NAME = "indivo" # Name of the archive of a whole run
+ARCHIVE_FORMATS = ('tar', 'zip')
+WRITE_BUFFER = 1 << 20 # Buffer size for output archives
+FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0) # For document files
+
 DCTERMS = rdflib.Namespace('http://purl.org/dc/terms/')
 
-SDMX = ChainableTemplate("""
+SDMX = CompiledTemplate("""
 <Models xmlns="http://indivo.org/vocab/xml/documents#">
 $models
 </Models>
 """)
 
-DEMOGRAPHICS = ChainableTemplate("""
+DEMOGRAPHICS = CompiledTemplate("""
 <Demographics xmlns="http://indivo.org/vocab/xml/documents#">
     <dateOfBirth>$dob</dateOfBirth>
     <gender>$gender</gender>
@@ -380,7 +541,7 @@ DEMOGRAPHICS = ChainableTemplate("""
 </Demographics>
 """)
 
-MEDICATION = ChainableTemplate("""
+MEDICATION = CompiledTemplate("""
 <Model name="Medication">
   <Field name="drugName_title">$name</Field>
   <Field name="drugName_system">http://purl.bioontology.org/ontology/RXNORM/</Field>
@@ -403,7 +564,7 @@ MEDICATION = ChainableTemplate("""
 </Model>
 """)
 
-FULFILLMENT = ChainableTemplate("""
+FULFILLMENT = CompiledTemplate("""
 <Model name="Fill">
   <Field name="date">$date</Field>
   <Field name="dispenseDaysSupply">$days</Field>
@@ -428,7 +589,7 @@ FULFILLMENT = ChainableTemplate("""
 </Model>
 """)
 
-PROBLEM = ChainableTemplate("""
+PROBLEM = CompiledTemplate("""
 <Model name="Problem">
   <Field name="startDate">$onset</Field>
   <Field name="endDate">$resolution</Field>
@@ -438,7 +599,7 @@ PROBLEM = ChainableTemplate("""
 </Model>
 """)
 
-DRUG_CLASS_ALLERGY = ChainableTemplate("""
+DRUG_CLASS_ALLERGY = CompiledTemplate("""
 <Model name="Allergy">
     <Field name="allergic_reaction_title">$reaction</Field>
     <Field name="allergic_reaction_system">http://purl.bioontology.org/ontology/SNOMEDCT/</Field>
@@ -455,7 +616,7 @@ DRUG_CLASS_ALLERGY = ChainableTemplate("""
 </Model>
 """)
 
-FOOD_ALLERGY = ChainableTemplate("""
+FOOD_ALLERGY = CompiledTemplate("""
 <Model name="Allergy">
     <Field name="allergic_reaction_title">$reaction</Field>
     <Field name="allergic_reaction_system">http://purl.bioontology.org/ontology/SNOMEDCT/</Field>
@@ -472,7 +633,7 @@ FOOD_ALLERGY = ChainableTemplate("""
 </Model>
 """)
 
-NO_ALLERGY = ChainableTemplate("""
+NO_ALLERGY = CompiledTemplate("""
 <Model name="AllergyExclusion">
     <Field name="name_title">$exclusion</Field>
     <Field name="name_identifier">$exclusion_id</Field>
@@ -480,7 +641,7 @@ NO_ALLERGY = ChainableTemplate("""
 </Model>
 """)
 
-QRESULTS = ChainableTemplate("""
+QRESULTS = CompiledTemplate("""
 <Field name="quantitative_result_normal_range_max_value">$high_val</Field>
 <Field name="quantitative_result_normal_range_max_unit">$units</Field>
 <Field name="quantitative_result_normal_range_min_value">$low_val</Field>
@@ -489,11 +650,11 @@ QRESULTS = ChainableTemplate("""
 <Field name="quantitative_result_value_unit">$units</Field>
 """)
 
-NRESULTS = ChainableTemplate("""
+NRESULTS = CompiledTemplate("""
 <Field name="narrative_result">$val</Field>
 """)
 
-LAB = ChainableTemplate("""
+LAB = CompiledTemplate("""
 <Model name="LabResult">
     <Field name="accession_number">$acc_num</Field>
     <Field name="test_name_title">$test_name_title</Field>
@@ -504,7 +665,7 @@ LAB = ChainableTemplate("""
 </Model>
 """)
 
-IMMUNIZATION = ChainableTemplate("""
+IMMUNIZATION = CompiledTemplate("""
 <Model name="Immunization">
     <Field name="date">$date</Field>
     <Field name="administration_status_title">$adm_status</Field>
@@ -525,7 +686,7 @@ IMMUNIZATION = ChainableTemplate("""
 </Model>
 """)
 
-ENCOUNTER = ChainableTemplate("""
+ENCOUNTER = CompiledTemplate("""
 <Model name="Encounter">
     <Field name="startDate">$start</Field>
     <Field name="endDate">$end</Field>
@@ -533,13 +694,13 @@ ENCOUNTER = ChainableTemplate("""
 </Model>
 """)
 
-ENCOUNTER_TYPE = ChainableTemplate("""
+ENCOUNTER_TYPE = CompiledTemplate("""
     <Field name="encounterType_title">Ambulatory encounter</Field>
     <Field name="encounterType_system">http://smartplatforms.org/terms/codes/EncounterType#</Field>
     <Field name="encounterType_identifier">ambulatory</Field>
 """)
 
-VITAL_SIGNS = ChainableTemplate("""
+VITAL_SIGNS = CompiledTemplate("""
 <Model name="VitalSigns">
     <Field name="date">$date</Field>
     <Field name="encounter">$encounter</Field>
@@ -547,7 +708,7 @@ VITAL_SIGNS = ChainableTemplate("""
 </Model>
 """)
 
-VITAL_SIGN = ChainableTemplate("""
+VITAL_SIGN = CompiledTemplate("""
 <Field name="${prefix}_unit">$unit</Field>
 <Field name="${prefix}_value">$val</Field>
 <Field name="${prefix}_name_title">$name_title</Field>
@@ -1,38 +1,142 @@
-from testdata import LABS_FILE, rndAccNum
+from testdata import LABS_FILE, ACC_NUM, rndAccNumber, patientRandom
 from codes import Loinc
+from array import array
+import rowindex
 import argparse
 import csv
+import json
+import re
 
-class Lab: 
-    """Create instances of lab results; 
-also maintains complete results list (by patient)
-and a dictionary of loinc code frequencies"""
+DATE = re.compile(r'^\d{4}-\d\d-\d\d$')
+NAN = float('nan')
+PERCENTILES = (5,25,50,75,95) # Reported by lab.py --stats
+
+def _number(s):
+    """Returns string s as a float, or NaN if it isn't a number"""
+    try: return float(s)
+    except ValueError: return NAN
+
+class LabTable(object):
+    """Column store of one patient's lab results.  Dates are kept as
+YYYYMMDD integers (or, if not YYYY-MM-DD, as -1 - their index in the
+Lab.strings pool), accession numbers by their numeric part, and all the
+other fields as indices into the pool; numbers holds the
+value of each result as a float (NaN if it isn't numeric)"""
+
+    STRING_COLUMNS = ('codes','names','scales','values','lows','highs','units')
+
+    def __init__(self,pid):
+        self.pid = pid
+        self.rng = patientRandom(pid,'labs') # For the accession numbers
+        self.dates = array('l')
+        self.accnums = array('l')
+        self.numbers = array('d')
+        for c in self.STRING_COLUMNS: setattr(self,c,array('i'))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['rng'] # Only needed while loading (and may be the random module)
+        return state
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self,i):
+        if i < 0: i += len(self.dates)
+        if not 0 <= i < len(self.dates): raise IndexError("lab result index out of range")
+        return Lab(self,i)
+
+    def __iter__(self):
+        for i in xrange(len(self.dates)): yield Lab(self,i)
+
+    def append(self,o):
+        """Adds a result, from a labs file row"""
+        intern = Lab.intern
+        code = o['LOINC']
+        loinc = Loinc.info.get(code)
+        scale = o['SCALE']#Loinc.info[code].scale
+        value = o['VALUE']
+        if scale=='Ord':
+          # The Ord choices are stored in the low value field, separated by ';'
+          low = o['LOW'].split('; ')
+          if len (low[0]) > 0 and not value in low:
+            # Print out error msg if Ord values not formatted properly:
+            print "%s -> Error for code %s: value=%s not in %s"%(
+              self.pid,code,value,low)
+
+        date = o['DATE']
+        if DATE.match(date): self.dates.append(int(date[:4]+date[5:7]+date[8:]))
+        else: self.dates.append(-1-intern(date)) # Kept as it is
+        self.codes.append(intern(code))
+        self.names.append(intern(loinc.name if loinc else o['NAME']))
+        self.scales.append(intern(scale))
+        self.values.append(intern(value))
+        try:
+          self.numbers.append(float(value))
+        except ValueError: self.numbers.append(NAN)
+        self.lows.append(intern(o['LOW']))
+        self.highs.append(intern(o['HIGH']))
+        # Handle units, update to UCUM if possible:
+        if loinc and loinc.ucum: #if there is a ucum unit available
+          self.units.append(intern(loinc.ucum))  # Then use it
+        else: self.units.append(intern(o['UNITS'])) # Otherwise, use result units
+        self.accnums.append(rndAccNumber(self.rng))
+
+class Lab(object): 
+    """View of a single lab result in a patient's LabTable.  The Lab class
+also maintains the complete results tables (by patient), the string pool
+they share and a dictionary of loinc code frequencies"""
+
+    __slots__ = ('table','i')
 
     codes = {}   # Dictionary of code frequency indexed by loinc code
-    results = {} # Dictionary of result lists, by patient id 
+    results = {} # Dictionary of LabTables, by patient id 
+    strings = [] # Pool of the distinct strings in lab results
+    stringIds = {} # Index of each string in the pool
 
     @classmethod
-    def load(cls):
-      """Loads patient lab observations"""
-      
-      # First build the codes and frequency dictionary:
-      labs = csv.reader(file(LABS_FILE,'U'),dialect='excel-tab')
-      header = labs.next() 
-      cindex = header.index('LOINC')  # Locate the LOINC index field
-      for lab in labs:
-        code = lab[cindex] # Get the loinc code from the result record
-        if code in cls.codes:  # Update the codes dictionary with the count
-          cls.codes[code] += 1
-        else: cls.codes[code] = 1
+    def intern(cls,s):
+      """Returns the index of string s in the pool, adding it if necessary"""
+      i = cls.stringIds.get(s)
+      if i is None:
+        i = cls.stringIds[s] = len(cls.strings)
+        cls.strings.append(s)
+      return i
 
-      # And initialize Loinc.info dictionary to handle these codes:
-      Loinc.load(cls.codes.keys())
+    @classmethod
+    def add(cls,o):
+      """Adds a result (from a labs file row) to its patient's table"""
+      pid = o['PID']
+      if not pid in cls.results: cls.results[pid] = LabTable(pid)
+      cls.results[pid].append(o)
+
+    @classmethod
+    def load(cls,pid=None,rows=None):
+      """Loads patient lab observations (just those for patient pid, if given,
+taken from rows if they've been read already), in one pass: each LOINC
+code is looked up the first time it turns up"""
+      if pid:
+        if rows is None: rows = rowindex.rows(LABS_FILE,'PID',pid)
+        for lab in rows:
+          cls.count(lab['LOINC'])
+          cls.add(lab)
+        return
 
-      # Now loop back through labs and build patient results lists:
       labs = csv.reader(file(LABS_FILE,'U'),dialect='excel-tab')
       header = labs.next() 
+      cindex = header.index('LOINC')  # Locate the LOINC index field
       for lab in labs:
-          cls(dict(zip(header,lab))) # Create a result instance (saved in Lab.results)
+          cls.count(lab[cindex])
+          cls.add(dict(zip(header,lab))) # Append the result to Lab.results
+
+    @classmethod
+    def count(cls,code):
+      """Counts a result for code (in Lab.codes), first loading the code's
+Loinc info if it is a new one"""
+      if code in cls.codes: cls.codes[code] += 1
+      else:
+        Loinc.lookup(code)
+        cls.codes[code] = 1
 
     @classmethod
     def stats(cls):
@@ -43,50 +147,113 @@ and a dictionary of loinc code frequencies"""
        total_results = 0
        for code in code_list: 
          total_results += cls.codes[code]
+         loinc = Loinc.info.get(code) # (Not every code is in the LOINC map)
          print "%s\t%d\t%s,\t%s\t%s"%(
            code,                        #loinc code
            cls.codes[code],             #frequency
-           Loinc.info[code].scale,      #scale of test
-           Loinc.info[code].ucum,       #UCUM code (if any)
-           Loinc.info[code].name        #Name of test
+           loinc.scale if loinc else '',  #scale of test
+           loinc.ucum if loinc else '',   #UCUM code (if any)
+           loinc.name if loinc else ''    #Name of test
            )
        print "%d lab results"%total_results
        print "%d patients with lab results"%len(cls.results)
        print "%d unique tests (LOINC codes)"%len(cls.codes)
 
-    def __init__(self,o):
-        self.pid = o['PID']
-        self.code= o['LOINC'] 
-        self.date = o['DATE']
-        if self.code in Loinc.info.keys():
-            self.name = Loinc.info[self.code].name
-        else: self.name = o['NAME']
-        self.scale = o['SCALE']#Loinc.info[self.code].scale
-        # Handle value and ranges:
-        self.value = o['VALUE']
-        if self.scale=='Qn':
-          self.low=o['LOW']
-          self.high=o['HIGH']
-        if self.scale=='Ord':
-          # The Ord choices are stored in the low value field, separated by ';'
-          self.low = o['LOW'].split('; ')
-          if len (self.low[0]) > 0 and not self.value in self.low:
-            # Print out error msg if Ord values not formatted properly:
-            print "%s -> Error for code %s: value=%s not in %s"%(
-              self.pid,self.code,self.value,self.low)
+    @classmethod
+    def statistics(cls,percentiles=PERCENTILES):
+       """Returns statistics of the loaded results, as a dictionary: for each
+LOINC code (most frequent first), the number of results and of patients
+with any, the distribution of the numeric values and the rates of values
+below and above their normal range (where they have one).  Computed with
+numpy over the columns of all the LabTables at once."""
+       import numpy
+       tables = [cls.results[pid] for pid in sorted(cls.results)]
+       def column(name): # (The arrays' typecodes are numpy's too)
+         arrays = [getattr(t,name) for t in tables]
+         if not arrays: return numpy.zeros(0)
+         return numpy.concatenate([numpy.frombuffer(a,a.typecode) for a in arrays])
+       patients = numpy.repeat(numpy.arange(len(tables)),[len(t) for t in tables])
+       pool = numpy.array([_number(s) for s in cls.strings]) # Numeric value of each string
+       codes, values, names = column('codes').astype(int), column('numbers'), column('names').astype(int)
+       low, high = pool[column('lows').astype(int)], pool[column('highs').astype(int)]
 
-        # Handle units, update to UCUM if possible:
-        if self.code in Loinc.info.keys() and Loinc.info[self.code].ucum: #if there is a ucum unit available
-          self.units = Loinc.info[self.code].ucum  # Then use it
-        else: self.units = o['UNITS'] # Otherwise, use result units
-
-        self.acc_num = rndAccNum()
-        #self.scale = Loinc.info[self.code].scale
-      
-        # Append result to the results dictionary of lists
-        if self.pid in  self.__class__.results:
-          self.__class__.results[self.pid].append(self)
-        else: self.__class__.results[self.pid] = [self]
+       ids, first, code = numpy.unique(codes,return_index=True,return_inverse=True)
+       k = len(ids)
+       results = numpy.bincount(code,minlength=k)
+       pairs = numpy.unique(code*max(len(tables),1)+patients) # Distinct (code, patient)
+       coverage = numpy.bincount(pairs//max(len(tables),1),minlength=k)
+
+       # The numeric values, sorted by code and then value:
+       numeric = ~numpy.isnan(values)
+       ncode, nvalue = code[numeric], values[numeric]
+       order = numpy.lexsort((nvalue,ncode))
+       ncode, nvalue = ncode[order], nvalue[order]
+       n = numpy.bincount(ncode,minlength=k)
+       start = numpy.cumsum(n)-n
+       total = numpy.bincount(ncode,weights=nvalue,minlength=k)
+       quantiles = {}
+       last = max(len(nvalue)-1,0)
+       for q in percentiles: # Interpolated between the nearest values, like numpy.percentile
+         pos = start+numpy.maximum(n-1,0)*(q/100.0)
+         lo = numpy.minimum(numpy.floor(pos).astype(int),last)
+         hi = numpy.minimum(numpy.ceil(pos).astype(int),last)
+         quantiles[q] = nvalue[lo]+(nvalue[hi]-nvalue[lo])*(pos-numpy.floor(pos)) if len(nvalue) else n*NAN
+
+       with numpy.errstate(invalid='ignore'): # (NaNs compare False)
+         ranged = numeric & (high > low) # ('0'-'0' isn't a range)
+         below = numpy.bincount(code[ranged & (values < low)],minlength=k)
+         above = numpy.bincount(code[ranged & (values > high)],minlength=k)
+       checked = numpy.bincount(code[ranged],minlength=k)
+
+       def rate(a,b):
+         return float(a)/b if b else None
+       stats = []
+       for i in numpy.argsort(-results,kind='mergesort'):
+         c = cls.strings[ids[i]]
+         loinc = Loinc.info.get(c)
+         s = {'code': c, 'name': cls.strings[names[first[i]]], 'scale': loinc.scale if loinc else None,
+              'results': int(results[i]), 'patients': int(coverage[i]),
+              'coverage': rate(coverage[i],len(tables)), 'numeric': int(n[i])}
+         if n[i]:
+           s.update({'min': float(nvalue[start[i]]), 'max': float(nvalue[start[i]+n[i]-1]),
+                     'mean': float(total[i]/n[i]),
+                     'percentiles': dict(("p%g"%q, float(quantiles[q][i])) for q in percentiles)})
+         if checked[i]:
+           s.update({'range_checked': int(checked[i]), 'below_range': rate(below[i],checked[i]),
+                     'above_range': rate(above[i],checked[i]),
+                     'out_of_range': rate(below[i]+above[i],checked[i])})
+         stats.append(s)
+       return {'results': int(results.sum()), 'patients': len(tables), 'codes': k, 'by_code': stats}
+
+    def __init__(self,table,i):
+        self.table = table
+        self.i = i
+
+    def _string(self,column):
+        return Lab.strings[getattr(self.table,column)[self.i]]
+
+    pid = property(lambda self: self.table.pid)
+    code = property(lambda self: self._string('codes'))
+    name = property(lambda self: self._string('names'))
+    scale = property(lambda self: self._string('scales'))
+    value = property(lambda self: self._string('values'))
+    number = property(lambda self: self.table.numbers[self.i])
+    high = property(lambda self: self._string('highs'))
+    units = property(lambda self: self._string('units'))
+    acc_num = property(lambda self: ACC_NUM%self.table.accnums[self.i])
+
+    @property
+    def date(self):
+        d = self.table.dates[self.i]
+        if d < 0: return Lab.strings[-1-d]
+        return "%04d-%02d-%02d"%(d//10000,d//100%100,d%100)
+
+    @property
+    def low(self):
+        """The low end of the range; for 'Ord' results, the list of choices"""
+        low = self._string('lows')
+        if self.scale=='Ord': return low.split('; ')
+        return low
 
     def asTabString(self):
        """Returns a tab-separated string representation of lab instance"""
@@ -107,6 +274,9 @@ if __name__== '__main__':
   parser = argparse.ArgumentParser(description='Test Data Lab Module')
   group = parser.add_mutually_exclusive_group()
   group.add_argument('--stats', 
+     action='store_true',help='writes statistics of the results by code (counts, value distributions, '
+                              'out of range rates, patient coverage) as JSON')
+  group.add_argument('--frequencies', 
      action='store_true',help='lists frequency distribution of codes')
   group.add_argument('--results', action='store_true', help='list all results')
   group.add_argument('--pid',nargs='?', const='1520204',
@@ -115,6 +285,9 @@ if __name__== '__main__':
  
   Lab.load()
   if args.stats:
+    print json.dumps(Lab.statistics(),indent=2,sort_keys=True)
+    parser.exit()
+  if args.frequencies:
     Lab.stats()
     parser.exit()
   if args.pid:
@@ -1,17 +1,26 @@
 from testdata import MEDS_FILE
+import rowindex
 import argparse
 import csv
 
 
-class Med: 
+class Med(object): 
     """Create instances of Medication list entries; 
 also maintains complete med lists by patient id"""
 
+    __slots__ = ('pid','start','end','rxn','name','sig','q','days','refills',
+                 'qtt','qttunit','freq','frequnit')
+
     meds = {} # Dictionary of med lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Med observations"""
+    def load(cls,pid=None,rows=None):
+      """Loads patient Med observations (just those for patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(MEDS_FILE,'PT_ID',pid)
+        for med in rows: cls(med)
+        return
       
       # Loop through meds and build patient med lists:
       meds = csv.reader(file(MEDS_FILE,'U'),dialect='excel-tab')
@@ -0,0 +1,85 @@
+"""Measures the memory taken per record by the domain classes, against the
+__dict__-based instances they used to be, on a synthetic input made by
+repeating the rows of the data files"""
+from testdata import PATIENTS_FILE, MEDS_FILE, VITALS_FILE, IMMUNIZATIONS_FILE
+from patient import Patient
+from med import Med
+from vitals import VitalSigns
+from immunization import Immunization
+from records import Record
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import resource
+import types
+
+TABLES = ((Patient,PATIENTS_FILE), (Med,MEDS_FILE),
+          (VitalSigns,VITALS_FILE), (Immunization,IMMUNIZATIONS_FILE))
+
+def rss():
+    """Returns the current resident set size, in bytes"""
+    try:
+      return int(open('/proc/self/statm').read().split()[1])*resource.getpagesize()
+    except IOError: # No /proc: make do with the peak
+      return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def synthetic(filename,n):
+    """Yields n row dictionaries, cycling through the rows of filename (each
+row is parsed again, so no strings are shared between rows)"""
+    lines = open(filename,'U').read().splitlines()
+    header = csv.reader(lines[:1],dialect='excel-tab').next()
+    for line in itertools.islice(itertools.cycle(lines[1:]),n):
+      yield dict(zip(header,csv.reader([line],dialect='excel-tab').next()))
+
+class OldRecord:
+    """A VitalSigns or Immunization instance as it used to be"""
+    def __init__(self,m):
+        for f in m:
+            setattr(self, f.lower(), m[f])
+        self.sourcerow = m
+
+def classic(cls):
+    """Returns an old-style (__dict__-based) copy of the slotted class cls"""
+    attrs = dict((k,v) for k, v in cls.__dict__.items()
+                 if not k in cls.__slots__ and not k in ('__slots__','__dict__','__weakref__'))
+    return types.ClassType(cls.__name__,(),attrs)
+
+def measure((i,variant,n)):
+    """Returns the bytes per record of n records of TABLES[i]"""
+    cls, filename = TABLES[i]
+    if variant == 'after': make = cls
+    elif issubclass(cls,Record): make = OldRecord
+    else:
+      old = classic(cls)
+      make = old
+      if cls is Patient: # Patients also kept their row, as p.demographics
+        def make(row):
+          p = old(row)
+          p.demographics = row
+          return p
+    rows = synthetic(filename,n)
+    kept = [make(rows.next())] # Warm up before taking the baseline
+    start = rss()
+    kept.extend(make(row) for row in rows)
+    return (rss()-start)/float(n-1)
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Record memory benchmark')
+  parser.add_argument('-n', type=int, default=1000000,
+                      help='Number of records of each type (default = 1000000)')
+  args = parser.parse_args()
+  if args.n < 2: parser.error("-n must be at least 2")
+
+  print "%-14s%12s%12s   (bytes per record, %d records)"%("Records","Before","After",args.n)
+  for i, (cls, filename) in enumerate(TABLES):
+    result = []
+    for variant in ('before','after'):
+      # Measure each in a fresh process, so neither inherits the other's heap
+      pool = multiprocessing.Pool(1)
+      result.append(pool.apply(measure,((i,variant,args.n),)))
+      pool.close()
+      pool.join()
+    print "%-14s%12.0f%12.0f"%(cls.__name__,result[0],result[1])
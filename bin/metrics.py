@@ -0,0 +1,157 @@
+"""Exports the progress of a generate.py --write or --write-indivo run for
+batch schedulers and dashboards (see generate.py --metrics): the patients
+written, throughput and ETA, the triples and bytes written, the memory in use
+and a histogram of the time each stage takes per patient.  Every so often a
+snapshot is appended to a JSON-lines file, and/or written (atomically) to a
+file in the Prometheus textfile collector format, e.g. for node_exporter's
+--collector.textfile.directory."""
+import bisect
+import json
+import os
+import resource
+import time
+
+# The upper bounds of the stage latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = 'smart_generator_' # Of the Prometheus metric names
+
+def rss():
+    """Returns the current resident set size, in bytes"""
+    try:
+      return int(open('/proc/self/statm').read().split()[1])*resource.getpagesize()
+    except IOError: # No /proc: make do with the peak
+      return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+class Metrics:
+    """The metrics of a run: stages are passed on from a profiler.Profile,
+and the patients written counted with patients()"""
+
+    def __init__(self,path=None,prom=None,interval=10.0):
+        self.path = path         # JSON-lines file to append snapshots to, or None
+        self.prom = prom         # Prometheus textfile to write snapshots to, or None
+        self.interval = interval # Seconds between snapshots
+        self.total = None        # Patients to write, if known
+        self.done = 0
+        self.triples = 0
+        self.bytes = 0
+        self.stages = {}         # stage -> [count, seconds, [patients in each bucket (and over)]]
+        self.started = self.written = time.time()
+
+    def observe(self,stage,seconds,triples=0,size=0):
+        """Records a run of stage, for one patient"""
+        if not stage in self.stages: self.stages[stage] = [0, 0.0, [0]*(len(BUCKETS)+1)]
+        s = self.stages[stage]
+        s[0] += 1
+        s[1] += seconds
+        s[2][bisect.bisect_left(BUCKETS,seconds)] += 1
+        self.triples += triples
+        self.bytes += size
+
+    def state(self):
+        """Returns what has been observed, for merge() (e.g. in a worker
+process)"""
+        return self.triples, self.bytes, self.stages
+
+    def merge(self,state):
+        """Adds in the observations of another Metrics' state()"""
+        triples, size, stages = state
+        self.triples += triples
+        self.bytes += size
+        for stage, (count, seconds, buckets) in stages.items():
+          if not stage in self.stages: self.stages[stage] = [0, 0.0, [0]*(len(BUCKETS)+1)]
+          s = self.stages[stage]
+          s[0] += count
+          s[1] += seconds
+          s[2] = [a+b for a, b in zip(s[2],buckets)]
+
+    def start(self,total):
+        """Starts the clock on writing total patients, with a first snapshot"""
+        self.total = total
+        self.started = time.time()
+        self.write()
+
+    def patients(self,n=1):
+        """Counts n more patients written, writing a snapshot if it's time"""
+        self.done += n
+        if time.time()-self.written >= self.interval: self.write()
+
+    def finish(self):
+        """Writes the final snapshot"""
+        self.write(True)
+
+    def snapshot(self,final=False):
+        """Returns the metrics as a dictionary"""
+        now = time.time()
+        elapsed = now-self.started
+        rate = self.done/elapsed if elapsed else 0.0
+        eta = None
+        if final: eta = 0.0
+        elif self.total is not None and rate: eta = max(0,self.total-self.done)/rate
+        stages = {}
+        for stage, (count, seconds, buckets) in self.stages.items():
+          cumulative, n = {}, 0
+          for bound, k in zip(BUCKETS+('+Inf',),buckets):
+            n += k
+            cumulative[str(bound)] = n
+          stages[stage] = {'count': count, 'seconds': round(seconds,6), 'buckets': cumulative}
+        return {'time': round(now,3), 'started': round(self.started,3),
+                'elapsed_seconds': round(elapsed,3), 'running': not final,
+                'patients_done': self.done, 'patients_total': self.total,
+                'patients_per_second': round(rate,3),
+                'eta_seconds': round(eta,1) if eta is not None else None,
+                'triples': self.triples, 'bytes': self.bytes,
+                'triples_per_second': round(self.triples/elapsed,1) if elapsed else 0.0,
+                'bytes_per_second': round(self.bytes/elapsed,1) if elapsed else 0.0,
+                'rss_bytes': rss(), 'stages': stages}
+
+    def write(self,final=False):
+        """Writes a snapshot of the metrics to the JSON-lines and Prometheus
+files"""
+        s = self.snapshot(final)
+        if self.path:
+          f = open(self.path,'a')
+          f.write(json.dumps(s,sort_keys=True)+'\n')
+          f.close()
+        if self.prom:
+          f = open(self.prom+'.%d.tmp'%os.getpid(),'w') # (Renamed, so it's never read half-written)
+          f.write(prometheus(s))
+          f.close()
+          os.rename(f.name,self.prom)
+        self.written = time.time()
+
+def _value(v):
+    if v is None: return 'NaN'
+    if isinstance(v,bool): return '1' if v else '0'
+    return repr(v)
+
+def prometheus(s):
+    """Returns a snapshot in the Prometheus text exposition format"""
+    lines = []
+    def metric(name,kind,help,samples):
+      lines.append('# HELP %s%s %s'%(PREFIX,name,help))
+      lines.append('# TYPE %s%s %s'%(PREFIX,name,kind))
+      for suffix, labels, value in samples:
+        lines.append('%s%s%s%s %s'%(PREFIX,name,suffix,labels,_value(value)))
+    for name, kind, help, key in (
+        ('running', 'gauge', 'Whether the run is still writing patients', 'running'),
+        ('start_time_seconds', 'gauge', 'When the run started, in seconds since the epoch', 'started'),
+        ('last_update_seconds', 'gauge', 'When these metrics were written, in seconds since the epoch', 'time'),
+        ('elapsed_seconds', 'gauge', 'Seconds since the run started', 'elapsed_seconds'),
+        ('patients_written_total', 'counter', 'Patients written so far', 'patients_done'),
+        ('patients', 'gauge', 'Patients to write in the run', 'patients_total'),
+        ('patients_per_second', 'gauge', 'Patients written per second, over the run', 'patients_per_second'),
+        ('eta_seconds', 'gauge', 'Estimated seconds until the run finishes', 'eta_seconds'),
+        ('triples_written_total', 'counter', 'RDF triples written so far', 'triples'),
+        ('bytes_written_total', 'counter', 'Bytes written so far', 'bytes'),
+        ('resident_memory_bytes', 'gauge', 'Resident set size of the generator process', 'rss_bytes')):
+      metric(name,kind,help,[('','',s[key])])
+    samples = []
+    for stage in sorted(s['stages']):
+      st = s['stages'][stage]
+      for bound in BUCKETS+('+Inf',):
+        samples.append(('_bucket','{stage="%s",le="%s"}'%(stage,bound),st['buckets'][str(bound)]))
+      samples.append(('_sum','{stage="%s"}'%stage,st['seconds']))
+      samples.append(('_count','{stage="%s"}'%stage,st['count']))
+    if samples: metric('stage_seconds','histogram','Seconds each stage takes per patient',samples)
+    return '\n'.join(lines)+'\n'
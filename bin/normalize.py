@@ -0,0 +1,145 @@
+"""Normalizes the data files for reading a patient at a time: each file is
+rewritten in order of its patient id column (with an external merge sort, so
+in bounded memory) with LF line endings, and the index of its rows by
+patient id is written next to it (see rowindex.sidecar), so loaders can seek
+straight to a patient's rows"""
+from testdata import DATA_PATH, PID_FIELDS
+from rowindex import RowIndex, sidecar
+import argparse
+import csv
+import heapq
+import itertools
+import os
+import tempfile
+
+RUN_ROWS = 100000 # Rows sorted in memory at a time
+
+class ByteCounter(object):
+    """Writes through to a file, counting the bytes"""
+    def __init__(self,f):
+        self.f = f
+        self.size = 0
+    def write(self,s):
+        self.f.write(s)
+        self.size += len(s)
+
+def isSorted(filename,field):
+    """Returns True if the rows of filename are in order of column field"""
+    rows = csv.reader(file(filename,'U'),dialect='excel-tab')
+    c = rows.next().index(field)
+    last = ''
+    for row in rows:
+      if len(row) <= c: continue
+      if row[c] < last: return False
+      last = row[c]
+    return True
+
+def isNormalized(filename,field):
+    """Returns True if filename has an up to date sidecar index by column
+field (so it is sorted by field too)"""
+    st = os.stat(filename)
+    try:
+      f = open(sidecar(filename,field),'rb')
+    except IOError: return False
+    header = f.read(RowIndex.HEADER.size)
+    f.close()
+    if len(header) < RowIndex.HEADER.size: return False
+    magic, mtime, size, count = RowIndex.HEADER.unpack(header)
+    return magic == RowIndex.MAGIC and (mtime,size) == (st.st_mtime,st.st_size)
+
+def sortFile(src,dst,field,index=False,run_rows=RUN_ROWS):
+    """Writes the rows of src to dst (which may be src) in order of column
+field, rows with the same value keeping their order, and with LF line
+endings: run_rows rows at a time are sorted in memory, and the sorted runs
+merged from temporary files.  With index, also writes dst's sidecar index
+by field.  Returns the number of rows and of distinct values of field."""
+    rows = csv.reader(file(src,'U'),dialect='excel-tab')
+    header = rows.next()
+    c = header.index(field)
+    runs = []
+    while True:
+      run = [row for row in itertools.islice(rows,run_rows) if len(row) > c]
+      if not run: break
+      run.sort(key=lambda row: row[c])
+      f = tempfile.TemporaryFile(dir=os.path.dirname(dst) or '.')
+      csv.writer(f,dialect='excel-tab',lineterminator='\n').writerows(run)
+      f.seek(0)
+      runs.append(f)
+
+    def keyed(i,f): # Ties go to the earlier run, so the sort is stable
+      for row in csv.reader(f,dialect='excel-tab'): yield row[c], i, row
+    out = ByteCounter(open(dst+'.tmp','wb'))
+    writer = csv.writer(out,dialect='excel-tab',lineterminator='\n')
+    writer.writerow(header)
+    if index:
+      idx = open(sidecar(dst,field)+'.tmp','wb')
+      idx.write(RowIndex.HEADER.pack(RowIndex.MAGIC,0,0,0)) # Filled in below
+    count = keys = 0
+    last = start = None
+    for key, i, row in heapq.merge(*[keyed(i,f) for i, f in enumerate(runs)]):
+      if key != last:
+        if index and last is not None:
+          idx.write(RowIndex.RECORD.pack(last,start,out.size-start))
+        if len(key) > RowIndex.KEY_SIZE:
+          raise ValueError("%s: key '%s' is too long to index"%(src,key))
+        last, start = key, out.size
+        keys += 1
+      writer.writerow(row)
+      count += 1
+    out.f.close()
+    for f in runs: f.close()
+    os.rename(dst+'.tmp',dst)
+
+    if index:
+      if last is not None: idx.write(RowIndex.RECORD.pack(last,start,out.size-start))
+      st = os.stat(dst) # (The index is only good for this version of the file)
+      idx.seek(0)
+      idx.write(RowIndex.HEADER.pack(RowIndex.MAGIC,st.st_mtime,st.st_size,keys))
+      idx.close()
+      os.rename(sidecar(dst,field)+'.tmp',sidecar(dst,field))
+    return count, keys
+
+def normalize(filename,run_rows=RUN_ROWS):
+    """Normalizes a data file in place; returns (patient id column, rows,
+patients), with a column of None if it has no patient id column (then
+only its line endings are changed)"""
+    rows = csv.reader(file(filename,'U'),dialect='excel-tab')
+    header = rows.next()
+    columns = [f for f in header if f in PID_FIELDS]
+    if columns:
+      return (columns[0],)+sortFile(filename,filename,columns[0],True,run_rows)
+    out = open(filename+'.tmp','wb')
+    writer = csv.writer(out,dialect='excel-tab',lineterminator='\n')
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+      if row:
+        writer.writerow(row)
+        count += 1
+    out.close()
+    os.rename(filename+'.tmp',filename)
+    return None, count, 0
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Data File Normalizer')
+  parser.add_argument('--data', metavar='dir', default=DATA_PATH,
+                      help='Directory of the data files to normalize (default = the data directory)')
+  parser.add_argument('--run-rows', metavar='N', type=int, default=RUN_ROWS,
+                      help='Rows to sort in memory at a time (default = %d)'%RUN_ROWS)
+  parser.add_argument('--force', action='store_true',
+                      help='Rewrite the files even if they are normalized already')
+  args = parser.parse_args()
+  if args.run_rows < 1: parser.error("--run-rows must be at least 1")
+
+  for name in sorted(os.listdir(args.data)):
+    path = os.path.join(args.data,name)
+    if not name.endswith('.txt') or not os.path.isfile(path): continue
+    header = csv.reader(file(path,'U'),dialect='excel-tab').next()
+    columns = [f for f in header if f in PID_FIELDS]
+    if columns and isNormalized(path,columns[0]) and not args.force:
+      print "%s: already normalized"%name
+      continue
+    field, count, patients = normalize(path,args.run_rows)
+    if field: print "%s: %d rows, %d patients (by %s)"%(name,count,patients,field)
+    else: print "%s: %d rows (no patient ids)"%(name,count)
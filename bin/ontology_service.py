@@ -1,43 +1,67 @@
 from common.rdf_tools.util import *
 from common.rdf_tools import rdf_ontology
+from vitals import VitalSigns
 import argparse
 
 cv = rdf_ontology.SMART_Class["http://smartplatforms.org/terms#CodedValue"]
 
-def code(g, uri):
-    types = filter(lambda x: x[2] != owl.NamedIndividual, 
+# Code systems whose codes are looked up over and over again while
+# writing vitals and immunizations (see warm() below)
+WARM_SYSTEMS = ("http://smartplatforms.org/terms/codes/EncounterType#",
+                "http://smartplatforms.org/terms/codes/ImmunizationAdministrationStatus#",
+                "http://smartplatforms.org/terms/codes/ImmunizationRefusalReason#")
+
+# Process-wide cache of code metadata from the ontology:
+# uri -> (types, system, identifier, title)
+code_cache = {}
+cache_stats = {'hits': 0, 'misses': 0}
+
+def code_info(uri):
+    """ Returns (types, system, identifier, title) for a code URI """
+    uri = URIRef(uri)
+    if uri in code_cache:
+        cache_stats['hits'] += 1
+        return code_cache[uri]
+    cache_stats['misses'] += 1
+
+    types = filter(lambda x: x[2] != owl.NamedIndividual,
                 cv.graph.triples((uri, rdf.type, None)))
 
     assert len(types)>0, "No types for %s"%uri.n3()
 
-    g.add((uri, rdf.type, sp.Code))
-    for t in types:
-        t = t[2]
-        g.add((uri, rdf.type, t))
-    
     if "#" in str(uri):
         sep="#"
     else:
         sep="/"
-        
+
     (sys, ident) = str(uri).rsplit(sep,1)
-        
-    g.add((uri, sp.system, Literal(sys+sep)))
-    g.add((uri, dcterms.identifier, Literal(ident)))
 
     titles = list(cv.graph.triples((uri, dcterms.title, None)))
     assert len(titles) == 1, "did not find exactly one title: %s"%titles
-    title = titles[0][2]
+
+    info = (tuple(t[2] for t in types), sys+sep, ident, titles[0][2])
+    code_cache[uri] = info
+    return info
+
+def _add_code(g, uri):
+    """ Adds the triples describing a code to g; returns its metadata """
+    (types, sys, ident, title) = info = code_info(uri)
+
+    g.add((uri, rdf.type, sp.Code))
+    for t in types:
+        g.add((uri, rdf.type, t))
+
+    g.add((uri, sp.system, Literal(sys)))
+    g.add((uri, dcterms.identifier, Literal(ident)))
     g.add((uri, dcterms.title, title))
+    return info
 
+def code(g, uri):
+    _add_code(g, uri)
     return uri
 
 def coded_value(g, uri):
-    code(g, uri)
-
-    titles = list(g.triples((uri, dcterms.title, None)))
-    assert len(titles) == 1, "did not find exactly one title: %s"%titles
-    title = titles[0][2]
+    title = _add_code(g, uri)[3]
 
     cvnode = BNode()
     g.add((cvnode, rdf.type, sp.CodedValue))
@@ -46,14 +70,34 @@ def coded_value(g, uri):
 
     return cvnode
 
+def warm(uris=None):
+    """ Precomputes the cache entries for uris; by default, for every vital
+sign and every code in WARM_SYSTEMS.  Returns the number of codes cached."""
+    if uris is None:
+        uris = [vt['uri'] for vt in VitalSigns.vitalTypes]
+        uris += [VitalSigns.systolic['uri'], VitalSigns.diastolic['uri']]
+        for s in set(cv.graph.subjects(rdf.type, None)):
+            if isinstance(s, URIRef) and str(s).startswith(WARM_SYSTEMS):
+                uris.append(s)
+    for uri in uris:
+        code_info(uri)
+    return len(code_cache)
+
 if __name__== '__main__':
 
   parser = argparse.ArgumentParser(description='Ontology Codes Module')
   group = parser.add_mutually_exclusive_group()
   group.add_argument('--uri', action='store_true', help='Get CodedValue for URI',
           default='http://smartplatforms.org/terms/codes/ImmunizationRefusalReason#documentedImmunityOrPreviousDisease')
+  group.add_argument('--warm', action='store_true',
+          help='Precompute the code cache and report its size')
   args = parser.parse_args()
- 
+
+  if args.warm:
+      print "%d codes cached"%warm()
+      print "%(hits)d hits, %(misses)d misses"%cache_stats
+      parser.exit()
+
   if args.uri:
       g = rdflib.Graph()
       coded_value(g, URIRef(args.uri))
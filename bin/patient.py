@@ -1,13 +1,18 @@
 from testdata import PATIENTS_FILE, RI_PATIENTS_FILE
 from testdata import rndDate, rndName, rndAddress, rndTelephone, toEmail, rndGestAge
-from random import randint
+from testdata import patientRandom
 import datetime
+import rowindex
 import argparse
 import csv
 
-class Patient:
+class Patient(object):
     """Creates patient instances and maintains a dictionary of all patients""" 
 
+    __slots__ = ('pid','fname','lname','gender','zip','dob','initial','street',
+                 'apartment','city','region','pcode','country','email','home',
+                 'cell','gestage')
+
     mpi = {}  # static dictionary to hold the master patient index.
 
 
@@ -26,25 +31,7 @@ class Patient:
       # Read in patient data:
       for pat in pats: 
         p=dict((zip(header,pat))) # create patient from header and row values     
-        # Add synthetic data
-        patient_name = rndName(p['GENDER'])
-        p['fname']=patient_name[0]
-        p['initial']=patient_name[1]
-        p['lname']=patient_name[2]
-        # Add random day of year to year of birth to get dob value
-        # Make it for the prior year so vists, tests come after birth
-        p['dob']=rndDate(int(p['YOB'])-1).isoformat()
-        # Map raw GENDER to SMART encoding values
-        # (For the moment, SMART only handles 'male' and 'female'...)
-        gender = 'male' if p['GENDER']=='M' else 'female'
-        p['gender'] = gender
-        p['email'] = toEmail(patient_name)
-        # Finally, add a random address:
-        adr = rndAddress()
-        p = dict(p.items() + adr.items())
-        p['home'] = '' if randint(0,1) else rndTelephone()
-        p['cell'] = '' if randint(0,1) else rndTelephone()
-        p['gestage'] = '' if randint(0,1) else rndGestAge()
+        p=cls.synthesize(p,patientRandom(p['PID'],'patient')) # (seeded per patient, with --seed)
         
         # Write out the new patient data file:
         # Start with the header (writing only once at the top of the file):
@@ -56,9 +43,40 @@ class Patient:
         print >>f, "\t".join([ p[field] for field in head])
       f.close()
      
+    @staticmethod
+    def synthesize(p,rng):
+      """Returns a copy of raw patient row p with synthetic names, dob,
+address, etc. added, drawn from random generator rng"""
+      p=dict(p)
+      # Add synthetic data
+      patient_name = rndName(p['GENDER'],rng)
+      p['fname']=patient_name[0]
+      p['initial']=patient_name[1]
+      p['lname']=patient_name[2]
+      # Add random day of year to year of birth to get dob value
+      # Make it for the prior year so vists, tests come after birth
+      p['dob']=rndDate(int(p['YOB'])-1,rng).isoformat()
+      # Map raw GENDER to SMART encoding values
+      # (For the moment, SMART only handles 'male' and 'female'...)
+      gender = 'male' if p['GENDER']=='M' else 'female'
+      p['gender'] = gender
+      p['email'] = toEmail(patient_name)
+      # Finally, add a random address:
+      adr = rndAddress(rng)
+      p = dict(p.items() + adr.items())
+      p['home'] = '' if rng.randint(0,1) else rndTelephone(rng)
+      p['cell'] = '' if rng.randint(0,1) else rndTelephone(rng)
+      p['gestage'] = '' if rng.randint(0,1) else rndGestAge(rng)
+      return p
+
     @classmethod
-    def load(cls,patient_file_name=PATIENTS_FILE):
-      """Load patients from a data file"""
+    def load(cls,patient_file_name=PATIENTS_FILE,pid=None,rows=None):
+      """Load patients from a data file (just patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(patient_file_name,'PID',pid)
+        for pat in rows: cls(pat)
+        return
 
       # Open data file and read in the first (header) record
       pats = csv.reader(file(patient_file_name,'U'),dialect='excel-tab')
@@ -68,32 +86,32 @@ class Patient:
       for pat in pats: 
         cls(dict(zip(header,pat))) # create patient from header and row values     
 
-    def __init__(self,patient_dictionary):
-      """Patient instance is initalized with a demographics dictionary"""
-      self.demographics = patient_dictionary
+    def __init__(self,demographics):
+      """Patient instance is initalized with a demographics dictionary
+(which isn't kept: its values are copied into the instance)"""
       # Initialize instance vars for backward compatibility
-      self.pid = self.demographics['PID']
-      self.fname = self.demographics['fname']
-      self.lname = self.demographics['lname']
-      self.gender= self.demographics['gender']
-      self.zip = self.demographics['pcode']
-      self.dob = self.demographics['dob']
+      self.pid = demographics['PID']
+      self.fname = demographics['fname']
+      self.lname = demographics['lname']
+      self.gender= demographics['gender']
+      self.zip = demographics['pcode']
+      self.dob = demographics['dob']
       
       # Initialize additional instance vars
-      self.initial = self.demographics['initial']
-      self.street = self.demographics['street']
-      self.apartment = self.demographics['apartment']
-      self.city = self.demographics['city']
-      self.region = self.demographics['region']
-      self.pcode = self.demographics['pcode']
-      self.country = self.demographics['country']
-      self.email = self.demographics['email']
-      self.home = self.demographics['home']
-      self.cell = self.demographics['cell']
-      self.gestage = self.demographics['gestage']
+      self.initial = demographics['initial']
+      self.street = demographics['street']
+      self.apartment = demographics['apartment']
+      self.city = demographics['city']
+      self.region = demographics['region']
+      self.pcode = demographics['pcode']
+      self.country = demographics['country']
+      self.email = demographics['email']
+      self.home = demographics['home']
+      self.cell = demographics['cell']
+      self.gestage = demographics['gestage']
       
       # Insert the patient instance into the Patient mpi store:
-      pid = self.demographics['PID']
+      pid = self.pid
       if not pid in self.__class__.mpi: self.__class__.mpi[pid]=self
 
     def asTabString(self):
@@ -0,0 +1,88 @@
+"""Reads the data files a patient at a time: every file is read in patient id
+order (from a sorted copy, if the file hasn't been sorted by normalize.py)
+and the files are merged by patient id, so only one patient's rows are ever
+held in memory"""
+from testdata import GENERATED_PATH, PATIENTS_FILE, MEDS_FILE, PROBLEMS_FILE, LABS_FILE
+from testdata import REFILLS_FILE, VITALS_FILE, IMMUNIZATIONS_FILE, PROCEDURES_FILE
+from testdata import SOCIALHISTORY_FILE, FAMILYHISTORY_FILE, ALLERGIES_FILE
+from patient import Patient
+from med import Med
+from problem import Problem
+from procedure import Procedure
+from refill import Refill
+from vitals import VitalSigns
+from immunization import Immunization
+from lab import Lab
+from codes import Loinc
+from allergy import Allergy
+from clinicalnote import ClinicalNote
+from socialhistory import SocialHistory
+from familyhistory import FamilyHistory
+from normalize import isNormalized, isSorted, sortFile
+import snapshot
+import csv
+import heapq
+import itertools
+import os
+
+# The classes that load the data files (in loading order), with their
+# files and patient id columns
+SOURCES = ((Patient,PATIENTS_FILE,'PID'), (Med,MEDS_FILE,'PT_ID'),
+           (Problem,PROBLEMS_FILE,'PID'), (Lab,LABS_FILE,'PID'),
+           (Refill,REFILLS_FILE,'PID'), (VitalSigns,VITALS_FILE,'PID'),
+           (Immunization,IMMUNIZATIONS_FILE,'PID'), (Procedure,PROCEDURES_FILE,'PID'),
+           (SocialHistory,SOCIALHISTORY_FILE,'PID'),
+           (FamilyHistory,FAMILYHISTORY_FILE,'PATIENT_ID'), (Allergy,ALLERGIES_FILE,'PID'))
+
+def sortedFile(filename,field):
+    """Returns filename if it's in order of column field, or else a sorted
+copy of it (cached under GENERATED_PATH, and made again when the file's
+mtime or size changes)"""
+    if isNormalized(filename,field): return filename
+    copy = os.path.join(GENERATED_PATH,'%s.%s.sorted'%(os.path.basename(filename),field))
+    st = os.stat(filename)
+    stamp = "%r %d"%(st.st_mtime,st.st_size)
+    try:
+      if open(copy+'.stamp').read() == stamp: return copy
+    except IOError: pass
+    if isSorted(filename,field): return filename
+    sortFile(filename,copy,field)
+    f = open(copy+'.stamp','w')
+    f.write(stamp)
+    f.close()
+    return copy
+
+def groups(filename,field):
+    """Yields (patient id, rows) for each patient in filename, which must be
+in order of the patient id column, field"""
+    rows = csv.reader(file(filename,'U'),dialect='excel-tab')
+    header = rows.next()
+    c = header.index(field)
+    rows = (row for row in rows if len(row) > c) # (Not blank lines, which would split a patient's rows)
+    for pid, patient in itertools.groupby(rows,lambda row: row[c]):
+      yield pid, [dict(zip(header,row)) for row in patient]
+
+def _tagged(i,filename,field):
+    for pid, rows in groups(sortedFile(filename,field),field): yield pid, i, rows
+
+def clear():
+    """Drops all the loaded patient data (but not the LOINC codes)"""
+    for cls, attr in snapshot.STATE:
+      if cls is Loinc: continue
+      value = getattr(cls,attr)
+      if isinstance(value,list): del value[:]
+      else: value.clear()
+
+def patients(pids=None):
+    """Loads the patients (or just those in pids) one at a time, in patient
+id order, yielding each one's id while it is the only patient loaded"""
+    streams = [_tagged(i,filename,field) for i, (cls, filename, field) in enumerate(SOURCES)]
+    for pid, tagged in itertools.groupby(heapq.merge(*streams),lambda t: t[0]):
+      rows = dict((i, patient) for p, i, patient in tagged)
+      if not 0 in rows or (pids is not None and not pid in pids): continue # Not a patient to write
+      clear()
+      for i, (cls, filename, field) in enumerate(SOURCES):
+        cls.load(pid=pid,rows=rows.get(i,[]))
+      ClinicalNote.load(pid=pid)
+      yield pid
+    clear()
@@ -1,17 +1,25 @@
 from testdata import PROBLEMS_FILE
+import rowindex
 import argparse
 import csv
 
 
-class Problem: 
+class Problem(object): 
     """Create instances of Problem; 
 also maintains complete problem lists by patient id"""
 
+    __slots__ = ('pid','start','end','snomed','name')
+
     problems = {} # Dictionary of problem lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Problem observations"""
+    def load(cls,pid=None,rows=None):
+      """Loads patient Problem observations (just those for patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(PROBLEMS_FILE,'PID',pid)
+        for prob in rows: cls(prob)
+        return
       
       # Loop through problems and build patient problem lists:
       probs = csv.reader(file(PROBLEMS_FILE,'U'),dialect='excel-tab')
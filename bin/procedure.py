@@ -1,16 +1,24 @@
 from testdata import PROCEDURES_FILE
+import rowindex
 import argparse
 import csv
 
 
-class Procedure: 
+class Procedure(object): 
     """Create instances of Procedure; also maintains complete procedure lists by patient id"""
 
+    __slots__ = ('pid','date','snomed','name','notes')
+
     procedures = {} # Dictionary of procedure lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Procedure observations"""
+    def load(cls,pid=None,rows=None):
+      """Loads patient Procedure observations (just those for patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(PROCEDURES_FILE,'PID',pid)
+        for proc in rows: cls(proc)
+        return
       
       # Loop through procedures and build patient procedure lists:
       procs = csv.reader(file(PROCEDURES_FILE,'U'),dialect='excel-tab')
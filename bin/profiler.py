@@ -0,0 +1,91 @@
+"""Profiles the sections of the patient graphs: the time each section of
+writePatientGraph takes for each patient, and the triples it adds and bytes
+it writes, totalled over a run (see generate.py --profile).  Each section can
+also be run under cProfile, for a stats file per section, and each run can
+be passed on to a metrics.Metrics (see generate.py --metrics)."""
+from normalize import ByteCounter
+import cProfile
+import os
+import time
+
+class Profile:
+    """Totals of the sections run (by section and by patient)"""
+
+    def __init__(self,dump=None,patients=True,metrics=None):
+        self.dump = dump     # Directory to write each section's cProfile stats to, or None
+        self.keep = patients # Whether to keep each patient's totals (for report)
+        self.metrics = metrics # A metrics.Metrics to pass each run on to, or None
+        self.sections = {}   # section -> [patients, seconds, triples, bytes]
+        self.order = []      # The sections, in the order they first ran
+        self.patients = {}   # pid -> [seconds, triples, bytes, slowest section, its seconds]
+        self.profilers = {}  # section -> cProfile.Profile
+        self.out = None
+
+    def output(self,f):
+        """Returns file f wrapped to count the bytes written to it, for the
+sections of the next patient (or f itself, if it counts them already, like
+the Indivo writers)"""
+        self.out = f if hasattr(f,'size') else ByteCounter(f)
+        return self.out
+
+    def _size(self):
+        return self.out.size if self.out else 0
+
+    def run(self,pid,section,g,f,*args):
+        """Runs f(*args), section of patient pid's PatientGraph g (or None),
+recording its time and the triples added to g and bytes written to the
+output; returns what f returns"""
+        triples, size = len(g.g) if g else 0, self._size()
+        profiler = None
+        if self.dump:
+          if not section in self.profilers: self.profilers[section] = cProfile.Profile()
+          profiler = self.profilers[section]
+        start = time.time()
+        if profiler: result = profiler.runcall(f,*args)
+        else: result = f(*args)
+        seconds = time.time()-start
+        self.record(pid,section,seconds,(len(g.g) if g else 0)-triples,self._size()-size)
+        return result
+
+    def record(self,pid,section,seconds,triples=0,size=0):
+        """Adds a run of section for patient pid to the totals"""
+        if self.metrics: self.metrics.observe(section,seconds,triples,size)
+        if not section in self.sections:
+          self.sections[section] = [0, 0.0, 0, 0]
+          self.order.append(section)
+        totals = self.sections[section]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += triples
+        totals[3] += size
+        if not self.keep: return
+        patient = self.patients.setdefault(pid,[0.0, 0, 0, None, 0.0])
+        patient[0] += seconds
+        patient[1] += triples
+        patient[2] += size
+        if seconds >= patient[4]: patient[3:] = [section, seconds]
+
+    def report(self,out,top=10):
+        """Prints the totals by section, slowest first, and the top slowest
+patients to out; writes the cProfile stats files, if profiling"""
+        seconds = sum(s[1] for s in self.sections.values()) or 1.0
+        print >>out, "\n%-18s %8s %9s %7s %10s %9s %11s %10s"%(
+          "Section","Patients","Seconds","% time","ms/patient","Triples","Triples/s","Bytes")
+        for section in sorted(self.order,key=lambda s: -self.sections[s][1]):
+          n, t, triples, size = self.sections[section]
+          print >>out, "%-18s %8d %9.3f %6.1f%% %10.2f %9d %11s %10d"%(
+            section, n, t, 100*t/seconds, 1000*t/n, triples,
+            "%d"%(triples/t) if t and triples else "-", size)
+
+        print >>out, "\nSlowest %d patients:"%min(top,len(self.patients))
+        print >>out, "%-12s %9s %9s %10s  %s"%("Patient","Seconds","Triples","Bytes","Slowest section")
+        slowest = sorted(self.patients,key=lambda pid: -self.patients[pid][0])[:top]
+        for pid in slowest:
+          t, triples, size, section, s = self.patients[pid]
+          print >>out, "%-12s %9.3f %9d %10d  %s (%.3fs)"%(pid, t, triples, size, section, s)
+
+        if self.dump:
+          if not os.path.isdir(self.dump): os.makedirs(self.dump)
+          for section, profiler in self.profilers.items():
+            profiler.dump_stats(os.path.join(self.dump,section+'.prof'))
+          print >>out, "\ncProfile stats for each section written to %s (see the pstats module)"%self.dump
@@ -0,0 +1,246 @@
+"""Streaming RDF serializers: triples are written straight to a file as
+they are added, without building (and indexing) an rdflib graph first"""
+from rdflib import BNode, Literal, URIRef
+from xml.sax.saxutils import escape
+import re
+
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+RDF_TYPE = URIRef(RDF_NS+"type")
+
+# Local names we are willing to abbreviate to a prefixed name
+LOCAL_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]*$')
+
+XML_ATTR_ENTITIES = {'"': '&quot;'}
+TURTLE_ESCAPES = (('\\','\\\\'), ('"','\\"'), ('\n','\\n'), ('\r','\\r'), ('\t','\\t'))
+
+# Stands in for a blank node label while a Fragment is serialized (NUL can't
+# occur in the RDF itself)
+PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+
+def _term(t,ranks):
+   """Sort key for term t, with blank nodes standing for their ranks"""
+   if isinstance(t,BNode): return (0, ranks[t], u'', u'', u'')
+   if isinstance(t,Literal): return (2, 0, unicode(t), unicode(t.datatype or ''), unicode(t.language or ''))
+   return (1, 0, unicode(t), u'', u'')
+
+def canonicalOrder(triples):
+   """Returns triples (e.g. an rdflib graph's) sorted so the order depends
+only on the graph, not on its store or its blank node ids: each blank node
+is ranked by the triples it is in (with the other blank nodes standing for
+their own ranks, refined until no more nodes can be told apart)"""
+   triples = list(set(triples))
+   bnodes = set(x for t in triples for x in t if isinstance(x,BNode))
+   ranks = dict.fromkeys(bnodes,0)
+   distinct = len(set(ranks.values()))
+   while True:
+     signatures = dict((b,[]) for b in bnodes)
+     for t in triples:
+       key = tuple(_term(x,ranks) for x in t)
+       for i, x in enumerate(t):
+         if isinstance(x,BNode): signatures[x].append((i,key))
+     for b in bnodes: signatures[b] = (ranks[b], tuple(sorted(signatures[b])))
+     order = dict((sig, i) for i, sig in enumerate(sorted(set(signatures.values()))))
+     ranks = dict((b, order[signatures[b]]) for b in bnodes)
+     if len(order) == distinct: break
+     distinct = len(order)
+   return sorted(triples,key=lambda t: tuple(_term(x,ranks) for x in t))
+
+class StreamingGraph:
+   """Write-only stand-in for an rdflib graph that serializes each triple
+to f (as RDF/XML or Turtle) as soon as it is added"""
+
+   def __init__(self,f,format="xml"):
+      if not format in ('xml','turtle'):
+        raise ValueError("Streaming serializer only supports 'xml' and 'turtle', not '%s'"%format)
+      self.f = f
+      self.format = format
+      self.namespaces = [('rdf',RDF_NS)] # (prefix, namespace) in binding order
+      self.bnodes = {}     # BNode -> short label, unique within this document
+      self.written = set() # Triples about URI resources (codes) already written
+      self.subject = None  # Subject of the currently open description
+      self.started = False
+      self.count = 0       # Number of triples written
+
+   def bind(self,prefix,namespace):
+      """Declare a namespace prefix (must happen before the first add)"""
+      assert not self.started, "Namespaces must be bound before any triples are added"
+      self.namespaces.append((prefix,unicode(namespace)))
+
+   def add(self,(s,p,o)):
+      """Serialize a single triple"""
+      if isinstance(s,URIRef):
+        # Code descriptions get re-added for every coded value that uses them;
+        # a graph would collapse the duplicates, so we do the same here
+        if (s,p,o) in self.written: return
+        self.written.add((s,p,o))
+      if not self.started: self._header()
+      if s != self.subject:
+        if self.subject is not None: self._endSubject()
+        self._startSubject(s)
+        self.subject = s
+      elif self.format == 'turtle':
+        self.write(" ;")
+      self._property(p,o)
+      self.count += 1
+
+   def __iadd__(self,other):
+      """Add all the triples of another graph (e.g. a clinical note), in
+canonicalOrder, so the same graph is always written the same way"""
+      for t in canonicalOrder(other): self.add(t)
+      return self
+
+   def __len__(self):
+      return self.count
+
+   def splice(self,fragment):
+      """Write out a pre-serialized Fragment as it is, with new labels for its
+blank nodes; returns a dictionary of the fragment's blank nodes to the new
+nodes standing for them in this document"""
+      if (fragment.format,fragment.namespaces) != (self.format,self.namespaces):
+        raise ValueError("Fragment was serialized for a different document")
+      if not self.started: self._header()
+      if self.subject is not None:
+        self._endSubject()
+        self.subject = None
+      nodes = dict((b, BNode()) for b in fragment.bnodes)
+      labels = dict(("%d"%i, self.label(nodes[b])) for i, b in enumerate(fragment.bnodes))
+      self.write(fragment.text%labels)
+      self.count += fragment.count
+      for s, p, o in fragment.resources:
+        if isinstance(o,BNode): o = nodes.setdefault(o,BNode())
+        self.add((s,p,o))
+      return nodes
+
+   def close(self):
+      """Finish off the document (the file itself is left open)"""
+      if not self.started: self._header()
+      if self.subject is not None: self._endSubject()
+      if self.format == 'xml': self.write("</rdf:RDF>\n")
+      self.subject = None
+
+   def write(self,s):
+      if isinstance(s,unicode): s = s.encode('utf-8')
+      self.f.write(s)
+
+   def label(self,b):
+      """Returns the document-local label for blank node b"""
+      if not b in self.bnodes: self.bnodes[b] = "b%d"%len(self.bnodes)
+      return self.bnodes[b]
+
+   def qname(self,uri):
+      """Returns (prefix, local name) for uri, or None if it can't be abbreviated"""
+      best = None
+      for prefix, ns in self.namespaces:
+        if uri.startswith(ns) and LOCAL_NAME.match(uri[len(ns):]):
+          if best is None or len(ns) > len(best[1]): best = (prefix,ns)
+      if best: return (best[0], uri[len(best[1]):])
+      return None
+
+   def _header(self):
+      self.started = True
+      if self.format == 'xml':
+        self.write('<?xml version="1.0" encoding="utf-8"?>\n<rdf:RDF')
+        for prefix, ns in self.namespaces:
+          self.write('\n   xmlns:%s="%s"'%(prefix,escape(ns,XML_ATTR_ENTITIES)))
+        self.write('\n>\n')
+      else:
+        for prefix, ns in self.namespaces:
+          self.write('@prefix %s: <%s> .\n'%(prefix,ns))
+        self.write('\n')
+
+   def _startSubject(self,s):
+      if self.format == 'xml':
+        if isinstance(s,BNode):
+          self.write('  <rdf:Description rdf:nodeID="%s">\n'%self.label(s))
+        else:
+          self.write('  <rdf:Description rdf:about="%s">\n'%escape(s,XML_ATTR_ENTITIES))
+      else:
+        self.write(self._turtleTerm(s))
+
+   def _endSubject(self):
+      if self.format == 'xml': self.write('  </rdf:Description>\n')
+      else: self.write(" .\n")
+
+   def _property(self,p,o):
+      if self.format == 'turtle':
+        pred = 'a' if p == RDF_TYPE else self._turtleTerm(p)
+        self.write("\n    %s %s"%(pred,self._turtleTerm(o)))
+        return
+
+      q = self.qname(p)
+      if q: tag, decl = "%s:%s"%q, ""
+      else: # Undeclared namespace: declare it on the element itself
+        sep = '#' if '#' in p else '/'
+        ns, local = p.rsplit(sep,1)
+        tag, decl = "ns0:%s"%local, ' xmlns:ns0="%s"'%escape(ns+sep,XML_ATTR_ENTITIES)
+
+      if isinstance(o,BNode):
+        self.write('    <%s%s rdf:nodeID="%s"/>\n'%(tag,decl,self.label(o)))
+      elif isinstance(o,URIRef):
+        self.write('    <%s%s rdf:resource="%s"/>\n'%(tag,decl,escape(o,XML_ATTR_ENTITIES)))
+      else:
+        attrs = decl
+        if o.language: attrs += ' xml:lang="%s"'%o.language
+        if o.datatype: attrs += ' rdf:datatype="%s"'%escape(o.datatype,XML_ATTR_ENTITIES)
+        self.write('    <%s%s>%s</%s>\n'%(tag,attrs,escape(o),tag))
+
+   def _turtleTerm(self,t):
+      if isinstance(t,BNode): return "_:%s"%self.label(t)
+      if isinstance(t,URIRef):
+        q = self.qname(t)
+        if q: return "%s:%s"%q
+        return "<%s>"%t
+      s = unicode(t)
+      for c, e in TURTLE_ESCAPES: s = s.replace(c,e)
+      s = '"%s"'%s
+      if t.language: s += "@%s"%t.language
+      elif t.datatype: s += "^^<%s>"%t.datatype
+      return s
+
+
+class _FragmentWriter(StreamingGraph):
+   """Serializes triples for a Fragment: no header, '%' escaped and
+placeholders for the blank node labels"""
+
+   def __init__(self,format,namespaces):
+      StreamingGraph.__init__(self,None,format)
+      self.namespaces = list(namespaces)
+      self.started = True
+      self.parts = []
+
+   def write(self,s):
+      if isinstance(s,unicode): s = s.encode('utf-8')
+      self.parts.append(s.replace('%','%%'))
+
+   def label(self,b):
+      if not b in self.bnodes: self.bnodes[b] = len(self.bnodes)
+      return "\x00%d\x00"%self.bnodes[b]
+
+class Fragment:
+   """Triples (e.g. a clinical note's) serialized ahead of time, for
+StreamingGraph.splice to copy into documents in the same format and with the
+same namespaces.  The descriptions of blank nodes are kept as text, with the
+node labels left to fill in for each document; triples about URI resources
+are kept as they are, so the document can still drop duplicates of them."""
+
+   def __init__(self,triples,format,namespaces):
+      w = _FragmentWriter(format,namespaces)
+      subjects, described, seen = [], {}, set()
+      self.resources = []
+      for t in triples:
+        if t in seen: continue
+        seen.add(t)
+        if not isinstance(t[0],BNode): self.resources.append(t)
+        else:
+          if not t[0] in described:
+            subjects.append(t[0])
+            described[t[0]] = []
+          described[t[0]].append(t)
+      for s in subjects: # Each node's triples together, in one description
+        for t in described[s]: w.add(t)
+      if w.subject is not None: w._endSubject()
+      self.format = format
+      self.namespaces = list(namespaces)
+      self.text = PLACEHOLDER.sub(r'%(\1)s',"".join(w.parts))
+      self.bnodes = sorted(w.bnodes,key=w.bnodes.get) # In placeholder order
+      self.count = w.count
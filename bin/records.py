@@ -0,0 +1,44 @@
+"""Compact record types for data file rows whose attributes are simply the
+(lower-cased) columns of the file, generated from the file's header"""
+
+_types = {} # (base class, fields) -> record type
+
+def recordType(base,fields):
+    """Returns the subclass of base with a slot for each of fields"""
+    fields = tuple(fields)
+    if not (base,fields) in _types:
+      _types[(base,fields)] = type(base.__name__,(base,),
+                                   {'__slots__': fields, '__module__': base.__module__})
+    return _types[(base,fields)]
+
+def _restore(base,fields,values):
+    """Rebuilds a pickled record (without registering it anywhere)"""
+    r = object.__new__(recordType(base,fields))
+    for f, v in zip(fields,values): setattr(r,f,v)
+    return r
+
+class Record(object):
+    """Base for classes whose instances are created from a row dictionary,
+like VitalSigns(row); each instance gets the record type for its columns"""
+    __slots__ = ()
+
+    def __new__(cls,row,*args,**kwargs):
+      fields = sorted(f.lower() for f in row)
+      return object.__new__(recordType(cls,fields))
+
+    def __init__(self,row):
+      for f in row: setattr(self,f.lower(),row[f])
+
+    def fields(self):
+      """Returns the names of the record's columns"""
+      return self.__class__.__slots__
+
+    def __reduce__(self):
+      # The generated types can't be pickled by name, so pickle the values
+      fields = self.fields()
+      return (_restore,(self.__class__.__bases__[0],fields,
+                        tuple(getattr(self,f) for f in fields)))
+
+    def asTabString(self):
+      """Returns a tab-separated string of the record's values (by column name)"""
+      return "\t".join([getattr(self,f) for f in self.fields()])
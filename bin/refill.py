@@ -1,33 +1,53 @@
 from testdata import REFILLS_FILE
+import rowindex
 import argparse
 import csv
 
 
-class Refill: 
+class Refill(object): 
     """Create instances of a med refill; 
 also maintains complete refills lists by patient id"""
 
+    __slots__ = ('pid','date','rxn','days','q')
+
     refills = {} # Dictionary of refills, by patient id 
+    histories = {} # Date-sorted refill histories, by (patient id, rxn)
 
     @classmethod
-    def load(cls):
-      """Loads med refills"""
+    def load(cls,pid=None,rows=None):
+      """Loads med refills (just those for patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(REFILLS_FILE,'PID',pid)
+        for refill in rows: cls(refill)
+        cls.index([pid])
+        return
       
       # Loop through refills and build med refill list:
       refills = csv.reader(file(REFILLS_FILE,'U'),dialect='excel-tab')
       header = refills.next() 
       for refill in refills:
           cls(dict(zip(header,refill))) # Create a refill instance 
+      cls.index()
+
+    @classmethod
+    def index(cls,pids=None):
+       """Builds the refill histories of patients pids (default = all)"""
+       for pid in (cls.refills.keys() if pids is None else pids):
+         fills = {}
+         for med in cls.refills.get(pid,[]):
+           if int(med.q): # non-zero quantity
+             fills[(med.rxn,med.date)]=med # and only one rxn per day
+         histories = {}
+         for (rxn,date) in sorted(fills):
+           histories.setdefault((pid,rxn),[]).append(fills[(rxn,date)])
+         cls.histories.update(histories)
 
     @classmethod
     def refill_list(cls,pid,rxn):
-       """Return a refill history for patient, pid, and for med, rxn""" 
-       refills = {}
-       if not pid in cls.refills: return []
-       for med in cls.refills[pid]:
-         if int(med.q) and med.rxn==rxn: # non-zero quantity
-           refills[rxn+med.date]=med # and only one rnx per day
-       return refills.values()
+       """Return a refill history for patient, pid, and for med, rxn,
+in date order (the list is shared: don't modify it)""" 
+       return cls.histories.get((pid,rxn),[])
 
     def __init__(self,p):
         self.pid = p['PID']
@@ -0,0 +1,139 @@
+"""Binary indexes that locate the rows of a tab-delimited file by the value of
+one of its columns (e.g. a patient id), so those rows can be read without
+parsing the rest of the file"""
+from testdata import GENERATED_PATH
+import csv
+import hashlib
+import mmap
+import os
+import re
+import struct
+
+# A line of a data file, terminated by CR (classic Mac), LF or CRLF
+LINE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n|$)')
+
+def splitLines(text):
+    """Splits text into lines on any of the line terminators, like 'U' mode"""
+    return [l.rstrip('\r\n') for l in LINE.findall(text) if l]
+
+class RowIndex:
+    """Sorted, memory-mapped table of (key, offset, length) records for one
+column of a data file.  Neighbouring rows with the same key share a record,
+so a file that is sorted by the key needs just one record per key.  The
+table is cached under GENERATED_PATH (by the data file's name and a hash of
+its full path, so data directories don't share indexes) and rebuilt
+whenever the data file's mtime or size changes (unless normalize.py has written it next to the file:
+see sidecar)"""
+
+    MAGIC = 'ROWIDX01'
+    HEADER = struct.Struct('<8sdQI')  # magic, source mtime, source size, count
+    RECORD = struct.Struct('<24sQQ')  # NUL-padded key, offset, length of rows
+    KEY_SIZE = 24
+
+    _open = {} # (filename, field) -> RowIndex
+
+    @classmethod
+    def open(cls,filename,field):
+      """Returns the index of filename by column field, (re)building it if necessary"""
+      st = os.stat(filename)
+      idx = cls._open.get((filename,field))
+      if idx is None or idx.stamp != (st.st_mtime,st.st_size):
+        idx = cls._open[(filename,field)] = cls(filename,field,st)
+      return idx
+
+    def __init__(self,filename,field,st):
+        self.filename = filename
+        self.field = field
+        self.stamp = (st.st_mtime,st.st_size)
+        self.path = os.path.join(GENERATED_PATH,'%s.%s.%s.idx'%(os.path.basename(filename),
+                                 hashlib.sha1(os.path.abspath(filename)).hexdigest()[:12],field))
+        self.source = open(filename,'rb')
+        self.header = self._parse(splitLines(self.source.read(65536))[0])
+        self.data = self._map(sidecar(filename,field)) # Written by normalize.py
+        if self.data is None: self.data = self._map(self.path)
+        if self.data is None: self.data = self._build()
+        self.count = self.HEADER.unpack_from(self.data)[3]
+
+    def _parse(self,line):
+        return csv.reader([line],dialect='excel-tab').next()
+
+    def _map(self,path):
+        """Memory-maps the index in path, if it exists and is up to date"""
+        try:
+          f = open(path,'rb')
+        except IOError: return None
+        try:
+          data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError): return None # e.g. an empty file
+        finally: f.close()
+        if len(data) < self.HEADER.size: return None
+        magic, mtime, size, count = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or (mtime,size) != self.stamp: return None
+        return data
+
+    def _build(self):
+        """Scans the data file and caches a new index; returns the index data"""
+        column = self.header.index(self.field)
+        self.source.seek(0)
+        text = self.source.read()
+        runs = []
+        lines = LINE.finditer(text)
+        lines.next() # Skip the header
+        for m in lines:
+          line = m.group().rstrip('\r\n')
+          fields = line.split('\t')
+          if len(fields) <= column: continue # A blank or short line: no key to index
+          key = fields[column]
+          if len(key) > self.KEY_SIZE:
+            raise ValueError("%s: key '%s' is too long to index"%(self.filename,key))
+          if runs and runs[-1][0] == key and runs[-1][2] == m.start():
+            runs[-1][2] = m.end() # Extend the run of rows for this key
+          else: runs.append([key,m.start(),m.end()])
+        runs.sort() # By key, then by position in the file
+        records = [self.RECORD.pack(key,start,end-start) for key, start, end in runs]
+        data = ''.join([self.HEADER.pack(self.MAGIC,self.stamp[0],self.stamp[1],len(records))]+records)
+        try:
+          tmp = self.path+'.tmp'
+          f = open(tmp,'wb')
+          f.write(data)
+          f.close()
+          os.rename(tmp,self.path)
+        except (IOError, OSError):
+          pass # Can't cache it: just use the index from memory this time
+        return data
+
+    def _record(self,i):
+        return self.RECORD.unpack_from(self.data,self.HEADER.size+i*self.RECORD.size)
+
+    def ranges(self,key):
+        """Returns the (offset, length) byte ranges holding the rows for key"""
+        if len(key) > self.KEY_SIZE: return []
+        padded = key.ljust(self.KEY_SIZE,'\0')
+        lo, hi = 0, self.count
+        while lo < hi: # Binary search for the first record for key
+          mid = (lo+hi)//2
+          if self._record(mid)[0] < padded: lo = mid+1
+          else: hi = mid
+        found = []
+        while lo < self.count:
+          k, offset, length = self._record(lo)
+          if k != padded: break
+          found.append((offset,length))
+          lo += 1
+        return found
+
+    def rows(self,key):
+        """Yields a dictionary (keyed by the file header) for each row with key"""
+        for offset, length in self.ranges(key):
+          self.source.seek(offset)
+          for row in csv.reader(splitLines(self.source.read(length)),dialect='excel-tab'):
+            yield dict(zip(self.header,row))
+
+def sidecar(filename,field):
+    """Returns the name of the index of filename by column field that
+normalize.py keeps next to it"""
+    return '%s.%s.idx'%(filename,field)
+
+def rows(filename,field,key):
+    """Yields the rows of filename whose column field holds key"""
+    return RowIndex.open(filename,field).rows(key)
@@ -0,0 +1,100 @@
+"""Binary snapshot of all the loaded source tables, so that the tab-delimited
+data files and clinical notes only have to be parsed again when they change"""
+from testdata import DATA_PATH, NOTES_PATH, LOINC_FILE, SNAPSHOT_FILE
+from patient import Patient
+from med import Med
+from problem import Problem
+from procedure import Procedure
+from refill import Refill
+from vitals import VitalSigns
+from immunization import Immunization
+from lab import Lab
+from codes import Loinc
+from allergy import Allergy
+from clinicalnote import ClinicalNote, toGraph
+from socialhistory import SocialHistory
+from familyhistory import FamilyHistory
+import records
+import rowindex
+import testdata
+import cPickle
+import hashlib
+import os
+import sys
+
+# The class attributes that hold the loaded state
+STATE = ((Patient,'mpi'), (Med,'meds'), (Problem,'problems'),
+         (Lab,'codes'), (Lab,'results'), (Lab,'strings'),
+         (Lab,'stringIds'), (Loinc,'info'), (Refill,'refills'),
+         (Refill,'histories'), (VitalSigns,'vitals'), (Immunization,'immunizations'),
+         (Procedure,'procedures'), (SocialHistory,'socialHistories'),
+         (FamilyHistory,'familyHistories'), (ClinicalNote,'clinicalNotes'),
+         (Allergy,'allergies'))
+
+# The other modules the loaded state depends on: the record types, the
+# parsing of the rows and what testdata generates (e.g. accession numbers)
+MODULES = (records, rowindex, testdata)
+
+def _source(module):
+   """Returns the .py file of module"""
+   return os.path.splitext(module.__file__)[0]+'.py'
+
+def sources():
+   """Returns the sorted list of files the loaded state is built from,
+including the modules that build it (or that it depends on)"""
+   files = [os.path.join(DATA_PATH,f) for f in os.listdir(DATA_PATH) if f.endswith('.txt')]
+   for root, dirs, names in os.walk(NOTES_PATH):
+     files += [os.path.join(root,n) for n in names]
+   files.append(LOINC_FILE)
+   for cls, attr in STATE: files.append(_source(sys.modules[cls.__module__]))
+   files += [_source(module) for module in MODULES]
+   return sorted(set(files))
+
+def inputHash():
+   """Returns a content hash of everything in sources() (and the seed)"""
+   h = hashlib.sha1('seed=%s\0'%testdata.SEED) # Seeded data differs
+   for name in sources():
+     h.update(name+'\0')
+     f = open(name,'rb')
+     for block in iter(lambda: f.read(1<<20), ''): h.update(block)
+     f.close()
+     h.update('\0')
+   return h.hexdigest()
+
+def load(key):
+   """Restores the loaded state from the snapshot if it was made from the
+inputs identified by key; returns True if it did"""
+   try:
+     f = open(SNAPSHOT_FILE,'rb')
+   except IOError: return False
+   try:
+     unpickler = cPickle.Unpickler(f)
+     if unpickler.load() != key: return False # Stale snapshot
+     state = unpickler.load()
+   except Exception: return False # Unreadable: just load the text files
+   finally: f.close()
+   for (cls, attr), value in zip(STATE, state):
+     setattr(cls, attr, value)
+   # Clinical notes are stored as triples, not rdflib graphs:
+   for pid, notes in ClinicalNote.clinicalNotes.items():
+     ClinicalNote.clinicalNotes[pid] = [toGraph(triples) for triples in notes]
+   return True
+
+def save(key):
+   """Writes the currently loaded state to the snapshot file, tagged with key"""
+   state = []
+   for cls, attr in STATE:
+     value = getattr(cls, attr)
+     if cls is ClinicalNote:
+       value = dict((pid, [list(g) for g in notes]) for pid, notes in value.items())
+     state.append(value)
+   tmp = SNAPSHOT_FILE+'.tmp'
+   try:
+     f = open(tmp,'wb')
+     pickler = cPickle.Pickler(f,cPickle.HIGHEST_PROTOCOL)
+     pickler.dump(key)
+     pickler.dump(state)
+     f.close()
+     os.rename(tmp,SNAPSHOT_FILE)
+   except (IOError, OSError):
+     pass # No snapshot this time; the data will simply be parsed again
@@ -1,17 +1,25 @@
 from testdata import SOCIALHISTORY_FILE
+import rowindex
 import argparse
 import csv
 
 
-class SocialHistory: 
+class SocialHistory(object): 
     """Create instances of SocialHistory; 
 also maintains socialHistory by patient id"""
 
+    __slots__ = ('pid','smokingStatusCode')
+
     socialHistories = {} # Dictionary of socialHistory by patient ID
 
     @classmethod
-    def load(cls):
-      """Loads patient SocialHistory"""
+    def load(cls,pid=None,rows=None):
+      """Loads patient SocialHistory (just that of patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(SOCIALHISTORY_FILE,'PID',pid)
+        for history in rows: cls(history)
+        return
       
       # Loop through socialHistories and build patient socialHistory lists:
       histories = csv.reader(file(SOCIALHISTORY_FILE,'U'),dialect='excel-tab')
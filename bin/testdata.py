@@ -1,13 +1,17 @@
-from random import randint, choice
 from string import ascii_uppercase, lower
 import datetime
+import hashlib
+import os
+import random
 
 # Constants for building test data from data 
 
 # Paths relative source data and mapping files
-DATA_PATH  = "../data/"
+# (the data directory can be overridden, e.g. with a scaled copy of the data)
+DATA_PATH  = os.path.join(os.environ.get('SMART_DATA_PATH',"../data"),'')
 MAP_PATH   =   "../maps/"
 RI_PATH   = "../ri-data/"
+GENERATED_PATH = "../generated-data/"
 
 # Data file names:
 PATIENTS_FILE  = DATA_PATH+'patients.txt'
@@ -24,8 +28,24 @@ NOTES_PATH = DATA_PATH+'notes'
 REFILLS_FILE = DATA_PATH+'refills.txt'
 RI_PATIENTS_FILE = RI_PATH+'ri-patients.txt'
 
+# Columns that hold the patient id, in the data files that have one
+PID_FIELDS = ('PID','PT_ID','PATIENT_ID')
+PID_STEP = 10**8 # Copy k of patient pid is patient pid + k*PID_STEP (at least: see cohort.pidStep)
+
 # Mapping file names:
 LOINC_FILE = MAP_PATH+'short_loinc.txt'
+# Tables mapping the codes of the raw extracts to standard codes (see etl.py):
+ICD9_SNOMED_FILE = MAP_PATH+'icd9_snomed.txt'
+NDC_RXNORM_FILE = MAP_PATH+'ndc_rxnorm.txt'
+OBS_LOINC_FILE = MAP_PATH+'obs_loinc.txt'
+
+# Seed for the random values generated for each patient (see patientRandom);
+# None (the default) means they are different every run
+SEED = None
+
+# Cache files (rebuilt automatically from the files above):
+SNAPSHOT_FILE = GENERATED_PATH+'snapshot.pickle'
+NOTES_CACHE_PATH = GENERATED_PATH+'notes/' # Parsed clinical notes, by file hash
 
 # Define some values for generating random demographics data
 # These values can be freely altered to change locations and names
@@ -74,51 +94,74 @@ SURNAMES = ('Smith','Johnson','Williams','Jones','Brown','Davis','Miller','Wilso
           'Cole','West','Diaz','Gibson','Rice','Shaw','Hunt','Black','Palmer')
 
 # Utility Functions for generating randomized data
+# (each takes the random generator to use: by default, the random module;
+# see patientRandom for the seeded, per-patient ones)
+
+def patientRandom(pid,stream='',seed=None):
+   """Returns the random generator for patient pid's stream of values (e.g.
+'labs').  Without a seed (or SEED) that is just the random module; with one,
+it is a random.Random of its own, seeded from the seed, pid and stream, so
+the values don't depend on the order (or process) patients are done in."""
+   if seed is None: seed = SEED
+   if seed is None: return random
+   digest = hashlib.sha1("%s/%s/%s"%(seed,pid,stream)).hexdigest()
+   return random.Random(long(digest,16))
 
-def rndDate(y):
+def setSeed(seed):
+   """Seeds patientRandom (None for unseeded, random values)"""
+   global SEED
+   SEED = seed
+
+def rndDate(y,rng=random):
    """Returns a random date within a given year."""
 
    d = datetime.date(y,1,1)      # Start with Jan 1st
    ylen = 366 if y%400 == 0 or (y%4 == 0 and y%100 != 0) else 365    # Adjust year length for leap years
-   r = randint(0,ylen-1)         # Generate random day in year   
+   r = rng.randint(0,ylen-1)         # Generate random day in year   
    return datetime.date.fromordinal(d.toordinal()+r)
 
-def rndName(gender):
+def rndName(gender,rng=random):
    """Returns a random, gender appropriate, common name tuple: (fn,ln)"""
    fnames = MALES if gender=='M' else FEMALES
-   return (fnames[randint(0,len(fnames)-1)],choice(ascii_uppercase),SURNAMES[randint(0,len(SURNAMES)-1)])
+   return (fnames[rng.randint(0,len(fnames)-1)],rng.choice(ascii_uppercase),SURNAMES[rng.randint(0,len(SURNAMES)-1)])
    
 def toEmail (name):
   return "%s.%s@example.com"%(lower(name[0]),lower(name[2]))
   
-def rndAddress():
+def rndAddress(rng=random):
   """
   Returns a random address"""
-  index = POSTAL_INDEX_CHOICES[randint(0,len(POSTAL_INDEX_CHOICES)-1)]
-  street = ' '.join((str(randint(1,100)),
-                     STREET_NAMES[randint(0,len(STREET_NAMES)-1)],
-                     STREET_TYPES[randint(0,len(STREET_TYPES)-1)]))
-  address = POSTAL_DATA[index]
+  index = POSTAL_INDEX_CHOICES[rng.randint(0,len(POSTAL_INDEX_CHOICES)-1)]
+  street = ' '.join((str(rng.randint(1,100)),
+                     STREET_NAMES[rng.randint(0,len(STREET_NAMES)-1)],
+                     STREET_TYPES[rng.randint(0,len(STREET_TYPES)-1)]))
+  address = dict(POSTAL_DATA[index]) # A copy: POSTAL_DATA is shared by every patient
   address['street'] = street
-  address['apartment'] = '' if randint(0,1) else ' '.join(('Apt', str(randint(1,30))))
+  address['apartment'] = '' if rng.randint(0,1) else ' '.join(('Apt', str(rng.randint(1,30))))
   return address
 
-def rndTelephone():
+def rndTelephone(rng=random):
   """
   Returns a random telephone"""
   telephone = '-'.join(( "800",
-                         str(randint(100,999)),
-                         str(randint(1000,9999)) ))
+                         str(rng.randint(100,999)),
+                         str(rng.randint(1000,9999)) ))
   return telephone
   
-def rndGestAge():
+def rndGestAge(rng=random):
   """
   Returns a random gestational age"""
-  gestage = '.'.join(( str(randint(30,45)),
-                         str(randint(0,9)) ))
+  gestage = '.'.join(( str(rng.randint(30,45)),
+                         str(rng.randint(0,9)) ))
   return gestage
   
-def rndAccNum():
+def rndAccNum(rng=random):
   """ Returns a random accession number """
-  return "A%d"%randint(100000000,999999999)
+  return ACC_NUM%rndAccNumber(rng)
+
+ACC_NUM = "A%d" # Accession number format
+
+def rndAccNumber(rng=random):
+  """ Returns the numeric part of a random accession number """
+  return rng.randint(100000000,999999999)
 
@@ -1,11 +1,16 @@
 from testdata import VITALS_FILE
+from records import Record
+import rowindex
 import argparse
 import csv
 
 
-class VitalSigns: 
-    """Create instances of VitalSigns list entries; 
-also maintains complete VitalSigns lists by patient id"""
+class VitalSigns(Record): 
+    """Create instances of VitalSigns list entries (with an attribute for
+each column of the vitals file); also maintains complete VitalSigns lists
+by patient id"""
+
+    __slots__ = ()
         
     vitalTypes = [{'name': 'height',
                         'uri': 'http://purl.bioontology.org/ontology/LNC/8302-2',
@@ -56,8 +61,13 @@ also maintains complete VitalSigns lists by patient id"""
     vitals = {} # Dictionary of VitalSign lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient VitalSigns observations"""
+    def load(cls,pid=None,rows=None):
+      """Loads patient VitalSigns observations (just those for patient pid, if given,
+taken from rows if they've been read already)"""
+      if pid:
+        if rows is None: rows = rowindex.rows(VITALS_FILE,'PID',pid)
+        for VitalSign in rows: cls(VitalSign)
+        return
       
       # Loop through VitalSigns and build patient VitalSigns lists:
       VitalSigns = csv.reader(file(VITALS_FILE,'U'),dialect='excel-tab')
@@ -67,18 +77,13 @@ also maintains complete VitalSigns lists by patient id"""
 
 
     def __init__(self,m):
-        for f in m:
-            setattr(self, f.lower(), m[f])
-        self.sourcerow = m
+        Record.__init__(self,m)
 
         # Append VitalSign to the patient's VitalSign list:
         if self.pid in  self.__class__.vitals:
           self.__class__.vitals[self.pid].append(self)
         else: self.__class__.vitals[self.pid] = [self]
 
-    def asTabString(self):
-        return self.sourcerow
-
 if __name__== '__main__':
 
   parser = argparse.ArgumentParser(description='Test Data Vitals Module')